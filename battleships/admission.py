@@ -0,0 +1,108 @@
+import time
+from collections import defaultdict
+
+from .battleships_data import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket():
+    """Allows rate events per second on average, and bursts of up to burst events."""
+
+    def __init__(self, rate, burst, now=None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.t = time.monotonic() if now is None else now
+
+    def fill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.t)*self.rate)
+        self.t = now
+
+    def take(self, now=None):
+        """Takes a token if there is one; returns whether it did."""
+        self.fill(time.monotonic() if now is None else now)
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def full(self, now):
+        self.fill(now)
+        return self.tokens >= self.burst
+
+
+class Admission():
+    """Decides which requests a server takes on, and which get BUSY.
+
+    A request is refused if its client has client_inflight requests that
+    were not replied to yet, if the players of its match have
+    match_inflight of them together, or if the client sent more than
+    client_rate requests per second on average (with bursts of up to
+    client_burst). Requests of clients that are not in a match (LOGIN,
+    mostly) share one more bucket of stranger_rate per second, so that a
+    flood of logins cannot crowd out the matches. A request-reply client
+    playing by the rules never has more than one request in flight, and
+    sends a few per turn, so it stays far from every limit.
+
+    The two players of a match can have no more than 2*client_inflight
+    requests in flight anyway, so match_inflight only limits anything if
+    it is less than that: with the defaults, a match gets three, so one
+    player can have two when the other waits for one reply.
+
+    admit() counts a request in flight, replied() counts its reply.
+    """
+    def __init__(self, client_inflight=CLIENT_INFLIGHT, match_inflight=MATCH_INFLIGHT,
+                 client_rate=CLIENT_RATE, client_burst=CLIENT_BURST,
+                 stranger_rate=STRANGER_RATE, stranger_burst=STRANGER_BURST):
+        self.client_inflight = client_inflight
+        self.match_inflight = match_inflight
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.strangers = TokenBucket(stranger_rate, stranger_burst)
+        self.buckets = {} # client identity -> TokenBucket
+        self.inflight = defaultdict(int) # client identity -> requests not replied to yet
+        self.refused = 0
+
+    def admit(self, client, players=None, now=None):
+        """Whether to take on a request of client.
+
+        players are the clients of its match, or None if client is not in
+        a match.
+        """
+        now = time.monotonic() if now is None else now
+        if self.inflight.get(client, 0) >= self.client_inflight:
+            return self.refuse(client, "too many requests in flight")
+        if players is not None and sum(self.inflight.get(c, 0) for c in players) >= self.match_inflight:
+            return self.refuse(client, "too many requests in flight in its match")
+        bucket = self.buckets.get(client)
+        if bucket is None:
+            bucket = self.buckets[client] = TokenBucket(self.client_rate, self.client_burst, now)
+        if not bucket.take(now):
+            return self.refuse(client, "too many requests per second")
+        if players is None and not self.strangers.take(now):
+            return self.refuse(client, "too many requests of clients without a match")
+        self.inflight[client] += 1
+        return True
+
+    def refuse(self, client, reason):
+        self.refused += 1
+        logger.debug(f"Client {client!r} is refused: {reason}.")
+        return False
+
+    def replied(self, client):
+        n = self.inflight.get(client)
+        if n is None:
+            return
+        if n > 1:
+            self.inflight[client] = n - 1
+        else:
+            del self.inflight[client]
+
+    def prune(self, now=None):
+        """Forgets the clients that are idle: nothing in flight, and a full bucket."""
+        now = time.monotonic() if now is None else now
+        for client in [c for c, bucket in self.buckets.items()
+                       if c not in self.inflight and bucket.full(now)]:
+            del self.buckets[client]
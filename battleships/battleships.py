@@ -1,16 +1,26 @@
 import argparse
+import asyncio
 import os
 import sys
+import time
 
-import numpy as np
 import zmq
-from termcolor import cprint
+import zmq.asyncio
 
 from .battleships_data import *
+from . import protocol
+from .renderer import Renderer, cell_width, label_width, viewport_size, heat_symbol, heat_text
 
 import logging
 logger = logging.getLogger(__name__)
 
+
+def cprint(*args, **kwds):
+    # termcolor is imported when something is printed first: bots that play
+    # quietly never need it.
+    import termcolor
+    termcolor.cprint(*args, **kwds)
+
 A=0
 B=1
 C=2
@@ -23,81 +33,264 @@ I=8
 J=9
 
 class ZMQClient(object):
-
-    def __init__(self, server, port):
-        self.context = zmq.Context()
-        logger.info(f"Connecting to server ({server}:{port})...")
+    """Request-reply connection to the server.
+
+    The client connects to tcp://server:port, or to endpoint if it is
+    given, e.g. "ipc:///tmp/battleships", or LOCAL_ENDPOINT for a server
+    in the same process (see battleships_server.ServerThread).
+
+    A request the server answers with BUSY is sent again after the delays
+    of BUSY_BACKOFF; after the last one, receive() raises
+    ConnectionRefusedError.
+    """
+    def __init__(self, server, port, context=None, endpoint=None):
+        if context is None and endpoint and endpoint.startswith("inproc://"):
+            # inproc only reaches sockets of the same context: the one of the server.
+            context = zmq.Context.shadow(zmq.asyncio.Context.instance().underlying)
+        # all clients of a process share one context (and its I/O thread).
+        self.context = context or zmq.Context.instance()
+        endpoint = endpoint or f"tcp://{server}:{port}"
+        logger.info(f"Connecting to server ({endpoint})...")
         self.socket = self.context.socket(zmq.REQ)
-        self.socket.connect (f"tcp://{server}:{port}")
+        self.socket.connect(endpoint)
+        self.match_id = 0
+        self.use_protocol(PROTOCOL_STRING)
+
+    def use_protocol(self, name):
+        self.protocol = name
+        self._encode = protocol.ENCODERS[name]
 
     def _enc(self, message):
-        return [i.encode() for i in message]
+        return self._encode(message, self.match_id)
 
     def _dec(self, message):
-        return [i.decode() for i in message]
+        message = protocol.decode(message)
+        if message[1:2] == [ERROR]:
+            # out of turn, or the server ended the match.
+            raise ConnectionAbortedError(f"The server refused the {message[0]} request.")
+        return message
     
     def send(self, message):
         message = self._enc(message)
+        self.last = message
         self.socket.send_multipart(message)
 
     def receive(self):
-        message = self.socket.recv_multipart()
-        message = self._dec(message)
-        return message
+        for backoff in (*BUSY_BACKOFF, None):
+            message = self._dec(self.socket.recv_multipart())
+            if not self.busy(message, backoff):
+                return message
+            time.sleep(backoff)
+            self.socket.send_multipart(self.last)
 
+    def busy(self, message, backoff):
+        """Whether message is a BUSY reply, to be sent again after backoff seconds."""
+        if message[1:2] != [BUSY]:
+            return False
+        if backoff is None:
+            raise ConnectionRefusedError(f"The server stayed busy with the {message[0]} request.")
+        logger.debug(f"The server is busy; sending {message[0]} again in {backoff} s.")
+        return True
 
-class Player():
-    def __init__(self, mine_field, enemy_field):
-        self.whoami = os.environ['USER']
+    def close(self):
+        self.socket.close()
+
+
+class AsyncZMQClient(ZMQClient):
+    """ZMQClient for asyncio: send() and receive() are coroutines."""
+
+    def __init__(self, server, port, context=None, endpoint=None):
+        super().__init__(server, port, context or zmq.asyncio.Context.instance(), endpoint)
+
+    async def send(self, message):
+        message = self._enc(message)
+        self.last = message
+        await self.socket.send_multipart(message)
+
+    async def receive(self):
+        for backoff in (*BUSY_BACKOFF, None):
+            message = self._dec(await self.socket.recv_multipart())
+            if not self.busy(message, backoff):
+                return message
+            await asyncio.sleep(backoff)
+            await self.socket.send_multipart(self.last)
+
+
+class AsyncPlayer():
+    """A player, talking to the server with asyncio.
+
+    login(), attack(), defend(), play() and logout() are coroutines, so
+    one process can run many players at the same time, all sharing one
+    zmq context. Player offers the same methods as plain functions.
+    """
+    def __init__(self, mine_field, enemy_field, strategy=None, name=None, verbose=True, binary=True,
+                 single=False, salvo=1, server_boards=False, heatmap=None):
+        self.whoami = name or os.environ['USER']
         self.fields = [mine_field, enemy_field]
+        self.strategy = strategy # if set, the player is played by the computer.
+        self.verbose = verbose
+        self.binary = binary # offer the binary protocol at login
+        self.single = single # ask for one request per side and turn at login
+        self.salvo = salvo # shots per turn, needs single or server_boards
+        self.server_boards = server_boards # ask the server to keep the boards at login
+        self.pending_results = [] # results still to be reported (single)
+        # On a terminal, only redraw what changed.
+        self.renderer = Renderer() if verbose and sys.stdout.isatty() else None
+        self.viewport = [0, 0] # first row and column drawn, on fields larger than the terminal
+        self.heatmap = heatmap # heatmap.Heatmap drawn over the enemy field, if set
         self.zmq = None
         self.player_id = None
-
-    def login(self, server='localhost', port=9002):
-        self.zmq = ZMQClient(server, port)
-        self.zmq.send([LOGIN, self.whoami])
-        response = self.zmq.receive()
+        self.match_id = None
+
+    async def login(self, server='localhost', port=9002, endpoint=None):
+        self.zmq = AsyncZMQClient(server, port, endpoint=endpoint)
+        message = [LOGIN, self.whoami]
+        if self.binary:
+            message.append(PROTOCOL_BINARY)
+        if self.single:
+            message.append(TURN_SINGLE)
+        if self.server_boards:
+            message.append(TURN_SERVER)
+        message += self.board_options()
+        await self.zmq.send(message)
+        # the server replies once we are paired with an opponent.
+        logger.info("Waiting for an opponent...")
+        response = await self.zmq.receive()
         assert response[0] == LOGIN
         if response[1] == LOGIN_ERROR:
-            logger.error("Failed to login. Too many users.")
-            raise ValueError("Failed to login. Too many users.")
+            logger.error("Failed to login. The match is full.")
+            raise ValueError("Failed to login. The match is full.")
         self.player_id = response[2]
-        logger.info(f"Logged in as user {self.player_id}")
-
-    def logout(self):
-        self.zmq.send([LOGOUT, self.whoami])
-        response = self.zmq.receive()
+        if len(response) > 3:
+            self.match_id = response[3]
+            self.zmq.match_id = int(self.match_id)
+        if PROTOCOL_BINARY in response[4:]:
+            self.zmq.use_protocol(PROTOCOL_BINARY)
+        # an older server plays the classic way, with one shot per turn.
+        self.server_boards = TURN_SERVER in response[4:]
+        # the server keeps the boards with the turns of TURN_SINGLE.
+        self.single = TURN_SINGLE in response[4:] or self.server_boards
+        if not self.single:
+            self.salvo = 1
+        if not set(self.board_options()) <= set(response[4:]):
+            raise ValueError("The server does not support the size or fleet of our fields.")
+        logger.info(f"Logged in as user {self.player_id} (match {self.match_id})")
+
+    def board_options(self):
+        """LOGIN options for the size and fleet of our fields."""
+        return board_options(self.fields[0].SIZE, self.fields[0].SHIPS)
+
+    async def logout(self):
+        await self.zmq.send([LOGOUT, self.whoami])
+        response = await self.zmq.receive()
         assert response[0] == LOGOUT and response[1] == LOGOUT_OK
+        self.zmq.close()
         logger.info(f"Logged out.")
+
+    async def heartbeat(self):
+        """Tells the server we are still there, while we are not playing."""
+        await self.zmq.send([HEARTBEAT])
+        response = await self.zmq.receive()
+        assert response[0] == HEARTBEAT
+
+    async def interact(self, function, *args):
+        """Calls function, which waits for our user, sending heartbeats meanwhile.
+
+        function runs in a thread, so the heartbeats keep the session
+        alive on the server however long the user takes. Returns what
+        function returns.
+        """
+        future = asyncio.get_running_loop().run_in_executor(None, function, *args)
+        while True:
+            done, pending = await asyncio.wait([future], timeout=HEARTBEAT_INTERVAL)
+            if done:
+                return future.result()
+            if self.zmq is not None:
+                await self.heartbeat()
+
+    async def send_fleet(self):
+        """Uploads our fleet, when the server keeps the boards."""
+        from .placement import fleet_ends
+        message = [FLEET]
+        for ends in fleet_ends(self.fields[0]):
+            for ix, iy in ends:
+                message += [protocol.row_label(ix), "%d" % (iy)]
+        await self.zmq.send(message)
+        # the reply comes when the opponent has sent its fleet too.
+        response = await self.zmq.receive()
+        assert response[0] == FLEET
+
+    async def play(self):
+        """Plays the game until it is over, and logs out; returns True if we won."""
+        if self.server_boards:
+            await self.send_fleet()
+        if self.verbose:
+            self.draw()
+        if self.player_id == '0':
+            role = ATTACKER
+        else:
+            role = DEFENDER
+
+        while True:
+            if role == ATTACKER:
+                end_of_game = await self.attack()
+            else:
+                end_of_game = await self.defend()
+            if end_of_game==3:
+                break
+            role = DEFENDER if role == ATTACKER else ATTACKER
+        await self.logout()
+        return role == ATTACKER
         
     def draw(self):
+        size = self.fields[0].SIZE
+        rows, columns = viewport_size(size)
+        ix0, iy0 = self.viewport
+        heat = None
+        if self.heatmap:
+            self.heatmap.update(self.fields[1])
+            heat = self.heatmap.probabilities()
+        if self.renderer:
+            self.renderer.draw(self.fields[1], self.fields[0], viewport=(ix0, iy0, rows, columns), heat=heat)
+            return
+        columns = range(iy0, min(size, iy0 + columns))
         # draw header
-        print("  ", end="")
-        for i in range(Field.SIZE):
-            print(f" {i} ", end="")
-        print("      ", end="")
-        for i in range(Field.SIZE):
-            print(f" {i} ", end="")
-        print()
-        for i in range(Field.SIZE):
-            self.fields[1].draw(i)
+        header = "".join(f"{i:>{cell_width(size)-1}} " for i in columns)
+        margin = " "*(label_width(size) + 1)
+        print(margin + header + "    " + margin + header)
+        for i in range(ix0, min(size, ix0 + rows)):
+            self.fields[1].draw(i, columns, heat)
             print("    ", end='')
-            self.fields[0].draw(i)
+            self.fields[0].draw(i, columns)
             print()
         print()
 
+    def follow(self, ix, iy):
+        """Moves the viewport, if needed, so that cell ix, iy is drawn."""
+        size = self.fields[0].SIZE
+        for axis, (i, n) in enumerate(zip((ix, iy), viewport_size(size))):
+            if not self.viewport[axis] <= i < self.viewport[axis] + n:
+                # center the cell
+                self.viewport[axis] = max(0, min(size - n, i - n//2))
 
     def _convert_to_indices(self, xs, ys):
-        ix = ord(xs) - 65
+        ix = protocol.row_index(xs)
         iy = int(ys)
         return ix, iy
 
     
     def enter_coordinates(self):
+        """Asks for coordinates, such as "D 3" (or "3 3").
+
+        On a field that is larger than the terminal, "view D 3" scrolls the
+        fields to show cell D 3.
+        """
+        size = self.fields[0].SIZE
         while True:
             ans = input("Coordinates, please: ")
+            view = ans.split()[:1] == ["view"]
             try:
-                x,y = ans.split()
+                x,y = ans.split()[view:]
             except ValueError:
                 print("Coordinates not understood.")
             else:
@@ -107,27 +300,71 @@ class Player():
                 except (ValueError, TypeError):
                     print("Not a valid coordinate. Try again.")
                 else:
-                    if ix<0 or ix>=Field.SIZE or iy<0 or iy>=Field.SIZE:
+                    if ix<0 or ix>=size or iy<0 or iy>=size:
                         print("Not a valid coordinate. Try again.")
+                    elif view:
+                        self.follow(ix, iy)
+                        self.draw()
                     else:
                         break # valid coorindates
-        return x, y, ix, iy
+        # the server only understands row letters.
+        return protocol.row_label(ix), y, ix, iy
         
-    def attack(self, x=None, y=None):
-        if  x is None and y is None:
+    def choose_target(self):
+        if self.strategy:
+            ix, iy = self.strategy.next_shot()
+            x, y = protocol.row_label(ix), str(iy)
+        else:
             x, y, ix, iy = self.enter_coordinates()
+        return x, y, ix, iy
+        
+    async def attack(self, x=None, y=None):
+        if  x is None and y is None and self.strategy:
+            shots = [self.choose_target() for i in range(self.strategy.salvo_size(self.salvo))]
+        elif x is None and y is None:
+            shots = [await self.interact(self.choose_target) for i in range(self.salvo)]
         else:
-            ix, iy = self._convert_to_indices(x, y)
+            shots = [(x, y, *self._convert_to_indices(x, y))]
+        if self.single:
+            results = await self._attack_single(shots)
+        else:
+            results = [await self._attack_classic(*shots[0][:2])]
+        for (x, y, ix, iy), result in zip(shots, results):
+            if self.strategy:
+                self.strategy.notify(ix, iy, result)
+            self.fields[1].process_result(result, ix, iy)
+        if self.verbose:
+            self.follow(ix, iy)
+            self.draw()
+            for result in results:
+                self._show_attack_result(result)
+        return 3 if 3 in results else results[-1]
+
+    async def _attack_classic(self, x, y):
         message = [ATTACK, x, y]
-        self.zmq.send(message)
-        message = self.zmq.receive()
+        await self.zmq.send(message)
+        message = await self.zmq.receive()
         assert message[0] == ATTACK
         # now ask for the result
         message = [ATTACK_REQ_RESULT]
-        self.zmq.send(message)
-        response = self.zmq.receive()
+        await self.zmq.send(message)
+        response = await self.zmq.receive()
         assert response[0] == ATTACK_REQ_RESULT
-        result = int(response[1])
+        return int(response[1])
+
+    async def _attack_single(self, shots):
+        # fire and report the results of the opponent's last shots at once.
+        message = [SHOT]
+        for x, y, ix, iy in shots:
+            message += [x, y]
+        message += ["%d" % (r) for r in self.pending_results]
+        self.pending_results = []
+        await self.zmq.send(message)
+        response = await self.zmq.receive()
+        assert response[0] == SHOT
+        return [int(r) for r in response[1:]]
+    
+    def _show_attack_result(self, result):
         if result==0:
             print("You missed.")
         elif result==1:
@@ -138,21 +375,60 @@ class Player():
             cprint("You sank the ship and won the battle.", "yellow", "on_red")
         elif result==-1:
             cprint("You shot at a coordinate you tried alreayd...", "yellow", "on_blue")
-        self.fields[1].process_result(result, ix, iy)
-        self.draw()
-        return result
 
-    def defend(self):
+    async def defend(self):
+        if self.single:
+            results = await self._defend_single()
+        else:
+            results = [await self._defend_classic()]
+        if self.verbose:
+            self.draw()
+            for result in results:
+                self._show_defend_result(result)
+        return 3 if 3 in results else results[-1]
+
+    async def _defend_classic(self):
         message = [DEFEND]
-        self.zmq.send(message)
-        response = self.zmq.receive()
+        await self.zmq.send(message)
+        response = await self.zmq.receive()
         assert response[0] == DEFEND
         x, y = response[1:]
         ix, iy = self._convert_to_indices(x, y)
         result = self.fields[0].check_attacked_coordinates(ix, iy)
         message = [DEFEND_REQ_RESULT, "%d" %(result)]
-        self.zmq.send(message)
-        response = self.zmq.receive()
+        await self.zmq.send(message)
+        response = await self.zmq.receive()
+        self.fields[0].process_result(result, ix, iy)
+        return result
+
+    async def _defend_single(self):
+        await self.zmq.send([INCOMING])
+        response = await self.zmq.receive()
+        assert response[0] == INCOMING
+        if self.server_boards:
+            # the server resolved the shots already.
+            coords, results = protocol.split_args(response[1:])
+            results = [int(r) for r in results]
+            for (x, y), result in zip(coords, results):
+                ix, iy = self._convert_to_indices(x, y)
+                self.fields[0].process_result(result, ix, iy)
+            return results
+        results = []
+        for x, y in zip(response[1::2], response[2::2]):
+            ix, iy = self._convert_to_indices(x, y)
+            result = self.fields[0].check_attacked_coordinates(ix, iy)
+            self.fields[0].process_result(result, ix, iy)
+            results.append(result)
+        if 3 in results:
+            # game over, we won't shoot again to take the results along.
+            await self.zmq.send([REPORT, *["%d" % (r) for r in results]])
+            response = await self.zmq.receive()
+            assert response[0] == REPORT
+        else:
+            self.pending_results = results
+        return results
+
+    def _show_defend_result(self, result):
         if result==0:
             print("Opponent missed.")
         elif result==1:
@@ -164,13 +440,52 @@ class Player():
         elif result==-1:
             print("Opponent missed.")
 
-        self.fields[0].process_result(result, ix, iy)
-        self.draw()
-        return result
 
-    
+class Player():
+    """Blocking front of an AsyncPlayer, for the command line client.
+
+    The coroutines of the AsyncPlayer run on an event loop of the
+    player's own, so a Player can be used from code that knows nothing of
+    asyncio. Other attributes are those of the AsyncPlayer.
+    """
+    def __init__(self, *args, **kwds):
+        self.player = AsyncPlayer(*args, **kwds)
+        self.loop = asyncio.new_event_loop()
+
+    def __getattr__(self, name):
+        return getattr(self.player, name)
+
+    def login(self, server='localhost', port=9002, endpoint=None):
+        return self.loop.run_until_complete(self.player.login(server, port, endpoint))
+
+    def logout(self):
+        return self.loop.run_until_complete(self.player.logout())
+
+    def attack(self, x=None, y=None):
+        return self.loop.run_until_complete(self.player.attack(x, y))
+
+    def interact(self, function, *args):
+        return self.loop.run_until_complete(self.player.interact(function, *args))
+
+    def defend(self):
+        return self.loop.run_until_complete(self.player.defend())
+
+    def play(self):
+        return self.loop.run_until_complete(self.player.play())
+
         
 class Field():
+    """A player's field: a dense grid with a value per cell.
+
+    SIZE and SHIPS are the defaults; a field of another size or with
+    another fleet is made with Field(size, ships). Cell values are 0 for
+    water, ship+1 for a ship, and -1, -2, -3 for the marks written by
+    process_result (missed, hit, sunk).
+
+    The grid is a list of rows, each a list of ints, so a field needs no
+    imports beyond the standard library (NumPy is only loaded by the
+    modules that work on many fields at once).
+    """
     SIZE=10
     SYMBOLS = dict(water='≈',ship='⊡',hit='⊛',sunk='◌', missed='⊙')
     FGCOLORS = dict(water='grey', ship='white', hit='red', sunk='green', missed='yellow')
@@ -178,69 +493,96 @@ class Field():
     
     SHIPS = (2, 3, 3, 4, 5)
     #SHIPS = (2,)
-    def __init__(self):
-        self.F = np.zeros((Field.SIZE, Field.SIZE), int)
+    def __init__(self, size=None, ships=None):
+        if size is not None:
+            self.SIZE = size
+        if ships is not None:
+            self.SHIPS = tuple(ships)
+        self.F = [[0]*self.SIZE for i in range(self.SIZE)]
         self.ships = []
-        self.hits = [0 for i in Field.SHIPS]
+        self.hits = [0 for i in self.SHIPS]
         
     def add(self, X,Y, ship, direction):
         x=X-1
         y=Y-1
         if ship in self.ships:
             raise ValueError('Ship already placed')
-        size = Field.SHIPS[ship]
+        size = self.SHIPS[ship]
         dm = dict(R=(1,0), D=(0,1), L=(-1,0), U=(0,-1))
         d, r= dm[direction]
         s = []
         for i in range(size):
             ix, iy  = x + r*i, y +d * i
-            if ix<0 or ix==Field.SIZE or iy<0 or iy==Field.SIZE:
+            if ix<0 or ix>=self.SIZE or iy<0 or iy>=self.SIZE:
                 raise ValueError('Ship out of domain')
-            if self.F[ix, iy]:
+            if self.cell(ix, iy):
                 raise ValueError('Overlapping ships')
             s.append((ix,iy))
         for ix, iy in s:
-            self.F[ix, iy] = ship + 1
+            self.mark(ix, iy, ship + 1)
         self.ships.append(ship)
         
     def mark(self, X,Y, value):
-        self.F[X,Y] = value
+        self.F[X][Y] = value
+
+    def cell(self, X, Y):
+        return self.F[X][Y]
+
+    def ship_cells(self):
+        """(ix, iy, ship) of every cell of a ship that has not been marked."""
+        for ix, row in enumerate(self.F):
+            for iy, value in enumerate(row):
+                if value > 0:
+                    yield ix, iy, value - 1
         
-    def draw(self, row):
-        print(f"{chr(65+row)} ", end='')
-        for i in range(Field.SIZE):
-            s = self.F[row,i]
-            if s==0:
-                symbol = "water"
-            elif s>0:
-                symbol = "ship"
-            elif s==-1:
-                symbol = "missed"
-            elif s==-2:
-                symbol = "hit"
-            elif s==-3:
-                symbol = "sunk"
+    def symbol(self, X, Y):
+        s = self.cell(X, Y)
+        if s==0:
+            symbol = "water"
+        elif s>0:
+            symbol = "ship"
+        elif s==-1:
+            symbol = "missed"
+        elif s==-2:
+            symbol = "hit"
+        elif s==-3:
+            symbol = "sunk"
+        return symbol
+        
+    def draw(self, row, columns=None, heat=None):
+        """Prints row, for the columns in range columns (all by default).
+
+        If heat is given (an array with the chance of a ship per cell), the
+        water cells show that chance in tenths.
+        """
+        width = cell_width(self.SIZE)
+        print(f"{protocol.row_label(row):>{label_width(self.SIZE)}} ", end='')
+        for i in columns or range(self.SIZE):
+            symbol = self.symbol(row, i)
+            if heat is not None and symbol == "water":
+                print(heat_text(heat_symbol(heat[row, i]), width, force_color=None), end='')
+                continue
             c = Field.SYMBOLS[symbol]
             fg = Field.FGCOLORS[symbol]
             bg = Field.BGCOLORS[symbol]
-            cprint(" ", fg, "on_blue", end='')
+            cprint(" "*(width-2), fg, "on_blue", end='')
             cprint(c, fg, bg, end='')
             cprint(" ", fg, bg, end='')
             
     def check_attacked_coordinates(self, ix, iy):
-        cell = self.F[ix, iy]
-        if cell == -1 or cell == -2:
+        cell = self.cell(ix, iy)
+        if cell == -1 or cell == -2 or cell == -3:
             r = -1 # already hit: tell them they missed.
         elif cell ==0:
             r = 0 # missed
         else: #
             ship = cell -1 # 0 is empty 1 is ship0, 2 is ship1 etc.
             self.hits[ship]+=1
-            if self.hits[ship] == Field.SHIPS[ship]:
+            if self.hits[ship] == self.SHIPS[ship]:
                 r=2 # ship sunk
             else:
                 r=1 # ship hit
-            if all([self.hits[i]==S for i, S in enumerate(Field.SHIPS)]):
+            if all([self.hits[i]==S for i, S in enumerate(self.SHIPS)]):
                 r=3 # all ships hit
         return r
 
@@ -255,6 +597,16 @@ class Field():
             self.mark(ix, iy,-3)
 
 
+def board_options(size, ships):
+    """LOGIN options asking for fields of size with ships, leaving out the defaults."""
+    options = []
+    if size != Field.SIZE:
+        options.append(f"{OPTION_SIZE}{size}")
+    if tuple(ships) != Field.SHIPS:
+        options.append(OPTION_SHIPS + ",".join("%d" % (i) for i in ships))
+    return options
+
+
 class UI:
 
     def __init__(self, player, mine):
@@ -262,6 +614,13 @@ class UI:
         self.mine = mine
 
     def add_ships(self):
+        if self.player.strategy:
+            self.player.strategy.place_ships(self.mine)
+            return
+        # the server does not hear from us while we place the ships.
+        self.player.interact(self._add_ships_interactively)
+
+    def _add_ships_interactively(self):
         print("You are about to place your ships.")
         print("I will tell you the length of the ship.")
         print("You choose a start coordinate, for example 'D 3'.")
@@ -302,22 +661,31 @@ class UI:
             return 0
 
     def play(self):
-        self.player.draw()
-        if self.player.player_id == '0':
-            role = ATTACKER
-        else:
-            role = DEFENDER
-
-        while True:
-            if role == ATTACKER:
-                end_of_game = self.player.attack()
-                role = DEFENDER
-            else:
-                end_of_game = self.player.defend()
-                role = ATTACKER
-            if end_of_game==3:
-                break
-        self.player.logout()
+        self.player.play()
+
+
+async def play_bots(n, strategy, host=HOST, port=PORT, size=Field.SIZE, ships=Field.SHIPS, endpoint=None,
+                    **options):
+    """Plays one game with each of n bot players at the same time.
+
+    strategy is the name of one of the STRATEGIES, size and ships are
+    those of the fields, options are passed on to AsyncPlayer. The bots
+    connect to endpoint if it is given, and to host:port otherwise.
+    Returns the number of games won.
+    """
+    from .strategies import STRATEGIES
+    from .sparse import make_field
+
+    async def bot(i):
+        mine = make_field(size, ships)
+        player = AsyncPlayer(mine, make_field(size, ships), strategy=STRATEGIES[strategy](size=size),
+                             name=f"bot-{i}", verbose=False, **options)
+        await player.login(host, port, endpoint)
+        player.strategy.place_ships(mine)
+        return await player.play()
+    
+    won = await asyncio.gather(*[bot(i) for i in range(n)])
+    return sum(won)
 
 
 def main():
@@ -329,10 +697,24 @@ Battleships client
 '''
     parser = argparse.ArgumentParser(description=description)
     parser.add_argument('HOSTNAME', nargs='?', default=HOST, help=f'Hostname or IP address of the Battleships server. Defaults to "{HOST}".')
+    parser.add_argument('-p', '--port', type=int, default=PORT, help=f'Port of the Battleships server. Defaults to {PORT}.')
+    parser.add_argument('--endpoint', default=None, help='Connect to this zmq endpoint instead of HOSTNAME and port, e.g. "ipc:///tmp/battleships".')
+    parser.add_argument('--serve', action='store_true', help=f'Start a server in this process, at --endpoint ("{LOCAL_ENDPOINT}" by default), and play against its other clients (e.g. --sessions bots).')
+    parser.add_argument('--bot', choices=['random', 'hunt', 'parity', 'heatmap'], default=None, help='Let the computer play, using the given strategy.')
+    parser.add_argument('--quiet', action='store_true', help='Do not draw the fields (only with --bot).')
+    parser.add_argument('--string-protocol', action='store_true', help='Do not use the binary protocol.')
+    parser.add_argument('--single', action='store_true', help='Play with one message exchange per turn; the opponent needs to use this option too.')
+    parser.add_argument('--salvo', type=int, default=1, help='Number of shots per turn (implies --single).')
+    parser.add_argument('--server-boards', action='store_true', help='Let the server keep the boards and resolve the shots; the opponent needs to use this option too.')
+    parser.add_argument('--size', type=int, default=Field.SIZE, help=f'Number of rows and columns of the fields; the opponent needs to use the same size. Defaults to {Field.SIZE}.')
+    parser.add_argument('--ships', default=",".join("%d" % (i) for i in Field.SHIPS), help='Lengths of the ships, separated by commas; the opponent needs to use the same fleet. Defaults to "%(default)s".')
+    parser.add_argument('--sessions', type=int, default=1, help='Number of bots to play at the same time, in this process (with --bot; implies --quiet).')
+    parser.add_argument('--heatmap', action='store_true', help='Show the chance of a ship, in tenths, on the cells of the enemy field not shot at yet.')
     parser.add_argument('--debug', action='store_true')
     
     args = parser.parse_args()
     host = args.HOSTNAME
+    ships = tuple(int(i) for i in args.ships.split(","))
 
     if args.debug:
         loglevel = logging.DEBUG
@@ -343,16 +725,46 @@ Battleships client
     logging.basicConfig(level=logging.WARNING, format=fmt)
     logger.setLevel(loglevel)
 
-    mine = Field()
-    enemy = Field()
+    endpoint = args.endpoint
+    if args.serve:
+        from .battleships_server import ServerThread
+        endpoint = endpoint or LOCAL_ENDPOINT
+        ServerThread(endpoint).start()
+
+    if args.bot and args.sessions > 1:
+        won = asyncio.run(play_bots(args.sessions, args.bot, host, args.port,
+                                    binary=not args.string_protocol, single=args.single or args.salvo>1,
+                                    salvo=args.salvo, server_boards=args.server_boards,
+                                    size=args.size, ships=ships, endpoint=endpoint))
+        logger.info(f"{args.sessions} bots won {won} games.")
+        return
+    
+    from .sparse import make_field
+    mine = make_field(args.size, ships)
+    enemy = make_field(args.size, ships)
 
-    player = Player(mine, enemy)
+    if args.bot:
+        from .strategies import STRATEGIES
+        strategy = STRATEGIES[args.bot](size=args.size)
+    else:
+        strategy = None
+    if args.heatmap:
+        from .heatmap import Heatmap
+        heatmap = Heatmap(args.size, ships)
+    else:
+        heatmap = None
+    player = Player(mine, enemy, strategy=strategy, verbose=not (args.bot and args.quiet),
+                    binary=not args.string_protocol, single=args.single or args.salvo>1,
+                    salvo=args.salvo, server_boards=args.server_boards, heatmap=heatmap)
     try:
-        player.login(host, PORT)
+        player.login(host, args.port, endpoint)
     except ValueError:
         pass
     else:
         ui = UI(player, mine)
-        ui.add_ships()
-        ui.play()
+        try:
+            ui.add_ships()
+            ui.play()
+        except ConnectionAbortedError as e:
+            logger.error(f"{e} The match has ended.")
 
@@ -1,6 +1,27 @@
 PORT = 9002
+BACKEND = "ipc:///tmp/battleships-backend" # front end <-> workers of a sharded server
+SPECTATE_PORT = 9003
+METRICS_PORT = 9004 # http, on localhost only
+PUBLISH_BACKEND = "ipc:///tmp/battleships-publish" # spectator messages of the workers
+LOCAL_ENDPOINT = "inproc://battleships" # server in the same process as its clients (ServerThread)
 HOST = "localhost"
 
+# seconds
+HEARTBEAT_INTERVAL = 10 # between the heartbeats of a client that is waiting for its user
+IDLE_TIMEOUT = 60 # without any request from a player that is not waiting for a reply
+TURN_TIMEOUT = 300 # without progress in a match
+LOBBY_TIMEOUT = 600 # waiting in the lobby for an opponent
+
+# admission control (see admission.Admission)
+CLIENT_INFLIGHT = 2 # requests of a client not replied to yet
+MATCH_INFLIGHT = 3 # requests of the players of a match not replied to yet; below 2*CLIENT_INFLIGHT
+CLIENT_RATE = 1000 # requests per second of a client, on average
+CLIENT_BURST = 200
+STRANGER_RATE = 500 # requests per second of all clients that are not in a match
+STRANGER_BURST = 1000
+RECEIVE_BATCH = 64 # requests a server takes from its socket at once, at most
+BUSY_BACKOFF = (0.05, 0.1, 0.2, 0.5, 1, 2) # seconds a client waits before sending a request again after BUSY
+
 STATUS=1
 REQUEST=2
 COORDS=3
@@ -12,12 +33,30 @@ ATTACK = "attack"
 ATTACK_REQ_RESULT = "attack_request_result"
 DEFEND = "defend"
 DEFEND_REQ_RESULT = "defend_request_result"
+SHOT = "shot"
+INCOMING = "incoming"
+REPORT = "report"
+FLEET = "fleet"
+HEARTBEAT = "heartbeat"
 
 LOGIN_OK="login_OK"
 LOGIN_ERROR="login_ERROR"
 OK="OK"
 LOGOUT_OK="logout_OK"
 LOGOUT_ERROR="logout_ERROR"
+ERROR="ERROR"
+BUSY="BUSY" # the server is overloaded, or the client sends too much: try again later
+
+PROTOCOL_STRING="string"
+PROTOCOL_BINARY="binary1"
+TURN_SINGLE="single"
+TURN_SERVER="server" # the server keeps the boards and resolves the shots
+OPTION_MATCH="match=" # LOGIN option to join a given match id, e.g. "match=12"
+OPTION_SIZE="size=" # LOGIN option for the number of rows and columns of the fields, e.g. "size=1000"
+OPTION_SHIPS="ships=" # LOGIN option for the lengths of the ships, e.g. "ships=2,3,3,4,5"
+MAX_SIZE=65536 # the binary protocol packs coordinates in unsigned shorts
+MAX_SHIPS=127 # and counts them in an unsigned byte; FLEET has two per ship
+MAX_SALVO=255 # cells (and results) of a SHOT, counted in an unsigned byte as well
 
 ATTACKER = 1
 DEFENDER = 2
@@ -1,89 +1,385 @@
+import argparse
 import asyncio
 import random
+import threading
+import time
 import zmq
 import zmq.asyncio
 
 from .battleships_data import *
+from . import protocol
+from .protocol import ENCODERS as protocol_encoders
+from .eventlog import EventLog, EV_LOGIN, EV_SHOT, EV_RESULT, EV_LOGOUT
+from .spectator import Broadcaster
+from .lobby import Lobby
+from .metrics import Metrics, UNKNOWN_OPCODE
+from .admission import Admission
+from .battleships import Field, board_options
+from .sparse import make_field
+from .placement import layout_from_ends, validate_fleet, fleet_ends
+from .strategies import RandomStrategy
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-async def client_task(name):
-    """Basic request-reply client using REQ socket."""
+async def client_task(name, stats=None, strategy=None, games=1, delay=2, host=HOST, port=PORT,
+                      binary=True, single=False, salvo=1, server_boards=False,
+                      size=Field.SIZE, ships=Field.SHIPS, endpoint=None):
+    """Request-reply bot client using REQ socket.
+
+    The client logs in and plays complete games, with its moves chosen
+    by strategy (random shots by default). If games is None, it keeps on
+    playing new games until it is cancelled. If stats is given,
+    stats.record(opcode, seconds) is called for every request, for every
+    attack turn ("turn") and for every finished game ("game"). If binary
+    is set, the binary protocol is offered at login. If single is set,
+    every turn takes one request per side, firing salvo shots at once.
+    If server_boards is set, the client uploads its fleet and the server
+    resolves the shots (TURN_SERVER), again with salvo shots per turn.
+    size and ships are those of the fields to play on. The client
+    connects to endpoint if it is given (e.g. "ipc:///tmp/battleships",
+    or "inproc://battleships" for a server in the same process), and to
+    tcp://host:port otherwise.
+    """
 
     # let's wait for some random time.
-    t = random.random()*2
+    t = random.random()*delay
     logger.debug(f"Client starts in {t} secs")
     await asyncio.sleep(t)
     logger.debug(f"Going to log in")
-    socket = zmq.asyncio.Context().socket(zmq.REQ)
+    socket = zmq.asyncio.Context.instance().socket(zmq.REQ)
     socket.identity = u"Client-{}".format(name).encode("ascii")
-    socket.connect("tcp://%s:%s" % (HOST, PORT))
-
-    # log in and get an id.
-
-    message = Server.enc([LOGIN, name])
-    socket.send_multipart(message)
-    message = await socket.recv_multipart()
-    message = Server.dec(message)
-    assert message[0]==LOGIN
-    if message[1]==LOGIN_ERROR:
-        logger.error(f"Player {name} cannot log in because too many players.")
-        return
+    socket.connect(endpoint or "tcp://%s:%s" % (host, port))
+    strategy = strategy or RandomStrategy(size=size)
+
+    def record(opcode, t0):
+        if stats is not None:
+            stats.record(opcode, time.perf_counter() - t0)
+    
+    encode = protocol.encode_string
+    match_id = 0
     
-    ident = int(message[2])
-    logger.info(f"Client {name} logged in as player {ident}")
+    async def request(message):
+        t0 = time.perf_counter()
+        for backoff in (*BUSY_BACKOFF, None):
+            socket.send_multipart(encode(message, match_id))
+            logger.debug(f"Request sent by {name} : {message}")
+            reply = protocol.decode(await socket.recv_multipart())
+            if reply[1:2] != [BUSY]:
+                break
+            if backoff is None:
+                raise ConnectionRefusedError(f"The server stayed busy (match {match_id}).")
+            await asyncio.sleep(backoff)
+        record(message[0], t0)
+        assert reply[0] == message[0]
+        if reply[1:2] == [ERROR]:
+            raise ConnectionAbortedError(f"The server refused {message[0]} (match {match_id}).")
+        return reply
 
-    # CLient has been logged in successfully. Now let's play.
+    try:
+        game = 0
+        while games is None or game < games:
+            t_game = time.perf_counter()
+            # log in and get an id.
+            encode = protocol.encode_string
+            options = ([PROTOCOL_BINARY] if binary else []) + ([TURN_SINGLE] if single else [])
+            if server_boards:
+                options.append(TURN_SERVER)
+            options += board_options(size, ships)
+            message = await request([LOGIN, name, *options])
+            if message[1]==LOGIN_ERROR:
+                logger.error(f"Player {name} cannot log in because the match is full.")
+                return
+            ident = int(message[2])
+            match_id = int(message[3])
+            if message[4:5] == [PROTOCOL_BINARY]:
+                encode = protocol.encode_binary
+            logger.info(f"Client {name} logged in as player {ident} in match {message[3]}")
 
-    for turn in range(2):
-        # Send request, get reply
-        if ident == 0:
-            message = Server.enc([ATTACK, "A", "5"])
-        else:
-            message = Server.enc([DEFEND])
-        socket.send_multipart(message)
-        logger.debug(f"Request ({message})sent by {name}/{ident}")
-        reply = await socket.recv_multipart()
-        reply = Server.dec(reply)
-        if ident == 0:
-            assert reply[0] == ATTACK
-        else:
-            assert reply[0] == DEFEND
-        logger.debug(f"Reply received by client {name}/{ident} : {reply}.")
-        # Send request, get reply
-        if ident == 1:
-            message = [ATTACK_REQ_RESULT]
-        else:
-            result = random.randint(-1, 4)
-            message = [DEFEND_REQ_RESULT, "%d" % (result)]
-        message = Server.enc(message)
-        socket.send_multipart(message)
-        logger.debug(f"Request sent by {name}/{ident} : {message}")
-        reply = await socket.recv_multipart()
-        reply = Server.dec(reply)
-        logger.info(f"Client {name} ({ident}) received: {reply[1]}")
-        ident +=1
-        ident %=2
+            # Client has been logged in successfully. Now let's play.
+            mine = make_field(size, ships)
+            strategy.reset()
+            strategy.place_ships(mine)
+            if server_boards:
+                message = [FLEET]
+                for ends in fleet_ends(mine):
+                    for ix, iy in ends:
+                        message += [protocol.row_label(ix), "%d" % (iy)]
+                reply = await request(message)
+                assert reply[1] == OK
+            attacking = ident == 0
+            pending = [] # results to report with the next shots (single)
+            while True:
+                if attacking and (single or server_boards):
+                    t0 = time.perf_counter()
+                    shots = [strategy.next_shot() for i in range(strategy.salvo_size(salvo))]
+                    message = [SHOT]
+                    for ix, iy in shots:
+                        message += [protocol.row_label(ix), "%d" % (iy)]
+                    reply = await request(message + pending)
+                    pending = []
+                    results = [int(r) for r in reply[1:]]
+                    for (ix, iy), result in zip(shots, results):
+                        strategy.notify(ix, iy, result)
+                    record("turn", t0)
+                    result = 3 if 3 in results else results[-1]
+                elif server_boards:
+                    reply = await request([INCOMING])
+                    coords, results = protocol.split_args(reply[1:])
+                    result = 3 if "3" in results else int(results[-1])
+                elif single:
+                    reply = await request([INCOMING])
+                    for x, y in zip(reply[1::2], reply[2::2]):
+                        ix, iy = protocol.row_index(x), int(y)
+                        result = mine.check_attacked_coordinates(ix, iy)
+                        mine.process_result(result, ix, iy)
+                        pending.append("%d" % (result))
+                        if result == 3:
+                            break
+                    if result == 3:
+                        await request([REPORT, *pending])
+                elif attacking:
+                    t0 = time.perf_counter()
+                    ix, iy = strategy.next_shot()
+                    await request([ATTACK, protocol.row_label(ix), "%d" % (iy)])
+                    reply = await request([ATTACK_REQ_RESULT])
+                    result = int(reply[1])
+                    strategy.notify(ix, iy, result)
+                    record("turn", t0)
+                else:
+                    reply = await request([DEFEND])
+                    x, y = reply[1:]
+                    ix, iy = protocol.row_index(x), int(y)
+                    result = mine.check_attacked_coordinates(ix, iy)
+                    mine.process_result(result, ix, iy)
+                    await request([DEFEND_REQ_RESULT, "%d" % (result)])
+                logger.debug(f"Client {name} ({ident}) turn result: {result}")
+                if result == 3:
+                    break
+                attacking = not attacking
+            await request([LOGOUT, name])
+            record("game", t_game)
+            logger.info(f"Client {name} finished game {game} ({'won' if attacking else 'lost'}).")
+            game += 1
+    finally:
+        socket.close(linger=0)
         
         
+def requested_match(options):
+    """Match id asked for with OPTION_MATCH in the LOGIN options, or None."""
+    for option in options:
+        if option.startswith(OPTION_MATCH):
+            return int(option[len(OPTION_MATCH):])
+    return None
+
+
+def requested_mode(options):
+    """Turn mode asked for in the LOGIN options: TURN_SERVER, TURN_SINGLE or None."""
+    if TURN_SERVER in options:
+        return TURN_SERVER
+    if TURN_SINGLE in options:
+        return TURN_SINGLE
+    return None
+
+
+def requested_board(options):
+    """Size and fleet asked for with OPTION_SIZE and OPTION_SHIPS in the LOGIN options.
+
+    Returns (size, ships), with the defaults of Field for what was not
+    asked for; raises ValueError if they do not make a playable game.
+    """
+    size = Field.SIZE
+    ships = Field.SHIPS
+    for option in options:
+        if option.startswith(OPTION_SIZE):
+            size = int(option[len(OPTION_SIZE):])
+        elif option.startswith(OPTION_SHIPS):
+            ships = tuple(int(i) for i in option[len(OPTION_SHIPS):].split(","))
+    if not 1 <= size <= MAX_SIZE:
+        raise ValueError(f"Fields of size {size} are not supported.")
+    if not 1 <= len(ships) <= MAX_SHIPS:
+        raise ValueError(f"Fleets of {len(ships)} ships are not supported.")
+    if not all(1 <= i <= size for i in ships) or sum(ships) > size*size//2:
+        raise ValueError(f"The fleet {ships} does not fit on a field of size {size}.")
+    return size, ships
+
+
+def parse_cells(coords, size):
+    """Cells (ix, iy) of coords, pairs of a row label and a column number as strings.
+
+    Raises ValueError if one of them is not a cell of a field of size, or
+    if there are more than a binary frame can count.
+    """
+    if len(coords) > MAX_SALVO:
+        raise ValueError(f"{len(coords)} coordinates are more than {MAX_SALVO}.")
+    cells = [(protocol.row_index(x), int(y)) for x, y in coords]
+    if not all(0 <= ix < size and 0 <= iy < size for ix, iy in cells):
+        raise ValueError(f"Coordinates {coords} are not all on a field of size {size}.")
+    return cells
+
+
+def parse_results(results):
+    """Results as numbers; raises ValueError if one is not a result of check_attacked_coordinates."""
+    if len(results) > MAX_SALVO:
+        raise ValueError(f"{len(results)} results are more than {MAX_SALVO}.")
+    results = [int(r) for r in results]
+    if not all(-1 <= r <= 3 for r in results):
+        raise ValueError(f"Results {results} are not all results of a shot.")
+    return results
+
+
+def worker_identity(worker):
+    return b"worker-%d" % (worker)
+
+
+class Match():
+    """State of a single game between two logged-in clients.
+
+    Every match has its own rendezvous state, so turns of different
+    matches never interfere with each other. A match just remembers who
+    is waiting for what: the attacker waiting for the results of its
+    shots (shooter), the defender waiting for shots (incoming_client),
+    shots nobody asked for yet, or (in classic matches) a result nobody
+    asked for yet. The request that completes a pair answers both, so a
+    turn takes no tasks or queues. Matches where the server keeps the
+    boards (TURN_SERVER) work the same way for the defender, and also
+    hold the boards of both players, whose turn it is, and the client
+    waiting for the fleet of its opponent. Every match has the size and
+    the fleet its players asked for at login.
+
+    t_progress is the time of the last request that played the match,
+    so that a match that got stuck can be ended.
+    """
+    __slots__ = ("match_id", "mode", "size", "ships", "players", "client_attacker", "client_defender",
+                 "shooter", "incoming_client", "shots", "result",
+                 "targets", "boards", "turn", "fleet_client", "t_progress")
+
+    def __init__(self, match_id, mode=None, size=Field.SIZE, ships=Field.SHIPS):
+        self.match_id = match_id
+        self.mode = mode
+        self.size = size
+        self.ships = ships
+        self.players = {} # client identity -> player id
+        self.client_attacker = None
+        self.client_defender = None
+        self.shooter = None
+        self.incoming_client = None
+        self.shots = None
+        self.result = None
+        self.targets = [] # shots waiting for their results, for the event log and spectators
+        self.boards = [None, None] # per player id (TURN_SERVER)
+        self.turn = 0 # player id of the attacker (TURN_SERVER)
+        self.fleet_client = None
+        self.t_progress = time.monotonic()
+
+    def is_full(self):
+        return len(self.players) == 2
+
+    
+class Session():
+    """A logged-in client, the match it plays in and its wire protocol.
+
+    t_seen is the time of the last request of the client, and pending
+    the opcode of the request it waits for a reply to (None if it does
+    not wait).
+    """
+    __slots__ = ("name", "player_id", "match", "protocol", "encode", "t_seen", "pending")
+
+    def __init__(self, name, player_id, match, protocol=PROTOCOL_STRING):
+        self.name = name
+        self.player_id = player_id
+        self.match = match
+        self.protocol = protocol
+        self.encode = protocol_encoders[protocol]
+        self.t_seen = time.monotonic()
+        self.pending = LOGIN
+
+    def accepted(self):
+        """The LOGIN options that are in effect for this session."""
+        accepted = [self.protocol]
+        if self.match.mode:
+            accepted.append(self.match.mode)
+        return accepted + board_options(self.match.size, self.match.ships)
+
+        
 class Server():
 
-    def __init__(self):
+    def __init__(self, endpoint=None, worker=None, log_dir=None, spectate=None, metrics_port=None,
+                 idle_timeout=IDLE_TIMEOUT, turn_timeout=TURN_TIMEOUT, lobby_timeout=LOBBY_TIMEOUT,
+                 admission=None):
+        """Game server.
+
+        The server binds a ROUTER socket to endpoint (tcp://*:PORT by
+        default). If worker is given, the server is worker number worker
+        of a sharded server instead: it connects a DEALER socket to the
+        back end of the front end at endpoint (BACKEND by default). The
+        front end delivers messages with the same envelope as a ROUTER
+        socket does, so the game logic is the same in both cases.
+
+        If log_dir is given, all events are written to an EventLog there.
+        If spectate is given, the shots and results of all matches are
+        published for spectators by a Broadcaster at that endpoint (bound,
+        or connected to the front end for a worker).
+        If metrics_port is given, Metrics are collected and served over
+        http on that port of localhost.
+
+        A match ends when one of its players sent nothing, not even a
+        HEARTBEAT, for idle_timeout seconds while it was not waiting for a
+        reply, or when it made no progress for turn_timeout seconds. The
+        requests waiting in it are answered with ERROR, and its players
+        are logged out. Players that waited
+        lobby_timeout seconds for an opponent are sent away. A timeout of
+        None (or 0) is never reached.
+
+        admission (an Admission, with the default limits if None) decides
+        which requests are taken on; the others are answered with BUSY
+        right away. The server takes up to RECEIVE_BATCH requests from its
+        socket at once, and handles those of the players in a match first.
+        When it finds a full batch waiting, it is falling behind, and
+        requests of clients that are not in a match get BUSY. A worker
+        takes on every LOGIN the front end forwards: the front end paired
+        it already, and its partner may have been told so.
+        """
         self.context = zmq.asyncio.Context.instance()
-        self.frontend = self.context.socket(zmq.ROUTER)
-        self.frontend.bind("tcp://*:%s" % (PORT))
+        self.sharded = worker is not None
+        if worker is None:
+            self.frontend = self.context.socket(zmq.ROUTER)
+            self.frontend.bind(endpoint or "tcp://*:%s" % (PORT))
+        else:
+            self.frontend = self.context.socket(zmq.DEALER)
+            self.frontend.identity = worker_identity(worker)
+            self.frontend.connect(endpoint or BACKEND)
 
 
         # Initialize main loop state
         self.poller = zmq.asyncio.Poller()
         self.poller.register(self.frontend, zmq.POLLIN)
-        self.Q_defender = asyncio.Queue()
-        self.Q_attacker = asyncio.Queue()
-        self.client_attacker = None
-        self.client_defender = None
+        self.matches = {}  # match id -> Match
+        self.sessions = {} # client identity -> Session
+        self.lobby = Lobby()
+        self.next_match_id = 0
+        self.eventlog = None
+        if log_dir:
+            self.eventlog = EventLog(log_dir)
+            self.next_match_id = self.eventlog.next_match_id()
+        self.broadcaster = None
+        if spectate:
+            self.broadcaster = Broadcaster(self.context, spectate, bind=worker is None)
+        self.recording = bool(self.eventlog or self.broadcaster)
+        self.tasks = set()
+        self.idle_timeout = idle_timeout
+        self.turn_timeout = turn_timeout
+        self.lobby_timeout = lobby_timeout
+        self.reaped = 0 # matches ended by a timeout
+        self.admission = admission or Admission()
+        self.metrics = None
+        self.metrics_port = metrics_port
+        if metrics_port:
+            self.metrics = Metrics()
+            self.t_request = {} # client identity -> (opcode, time) of its pending request
+            self.add_gauges()
         logger.info("Zeeslag server started...")
         
     @classmethod    
@@ -94,8 +390,46 @@ class Server():
     def dec(cls, message):
         return [i.decode() for i in message]
 
+    def add_gauges(self):
+        m = self.metrics
+        m.gauge("battleships_matches", "Active matches.", lambda: len(self.matches))
+        m.gauge("battleships_players", "Players in a match.", lambda: len(self.sessions))
+        m.gauge("battleships_lobby_players", "Players waiting in the lobby.", self.lobby.depth)
+        m.gauge("battleships_lobby_longest_wait_seconds", "Wait so far of the longest waiting player.",
+                self.lobby.longest_wait)
+        m.gauge("battleships_waiting_players", "Players waiting for a reply.",
+                lambda: sum(1 for i in self.sessions.values() if i.pending is not None))
+        m.gauge("battleships_reaped_matches", "Matches ended by a timeout since the start.", lambda: self.reaped)
+        m.gauge("battleships_busy_replies", "Requests answered with BUSY since the start.",
+                lambda: self.admission.refused)
+
+    def send(self, client, frames):
+        session = self.sessions.get(client)
+        if session is not None:
+            session.pending = None
+        self.admission.replied(client)
+        if self.metrics:
+            pending = self.t_request.pop(client, None)
+            if pending is not None:
+                self.metrics.observe(pending[0], time.perf_counter() - pending[1])
+        self.frontend.send_multipart([client, b"", *frames])
 
+    def reply(self, client, message):
+        session = self.sessions.get(client)
+        if session is None:
+            frames = self.enc(message)
+        else:
+            frames = session.encode(message, session.match.match_id)
+        self.send(client, frames)
 
+    def busy(self, client, opcode):
+        """Answers a request that is not taken on with BUSY."""
+        session = self.sessions.get(client)
+        if session is None:
+            frames = self.enc([opcode, BUSY])
+        else:
+            frames = session.encode([opcode, BUSY], session.match.match_id)
+        self.frontend.send_multipart([client, b"", *frames])
         
     def start_test_clients(self):
         names = ["leonie", "lucas"] #, "luisa"]
@@ -103,113 +437,595 @@ class Server():
         for i in names:
             tasks.append(asyncio.create_task(client_task(i)))
 
+    def login(self, client, name, options=()):
+        """Logs in a client.
+
+        options are the extras of the LOGIN request. A client waits in the
+        lobby until another client with the same turn mode, field size and
+        fleet logs in; then
+        both join a new match, the one that waited longest as player 0.
+        With OPTION_MATCH, the client joins the given match right away
+        instead (raising ValueError if it is full). A size or fleet that
+        makes no game raises ValueError too.
+
+        Returns the list of (client, Session) that joined a match: empty
+        if the client waits in the lobby, otherwise the ones to reply to.
+        """
+        if client in self.sessions:
+            # same socket logging in again: it left its previous game.
+            self.logout(client)
+        mode = requested_mode(options)
+        size, ships = requested_board(options)
+        match_id = requested_match(options)
+        if match_id is not None:
+            # paired by someone else, such as the front end of a sharded server.
+            self.lobby.leave(client)
+            match = self.matches.get(match_id)
+            if match is None:
+                match = Match(match_id, mode, size, ships)
+                self.matches[match_id] = match
+            elif match.is_full():
+                raise ValueError(f"Match {match_id} is full.")
+            return [self.join(match, client, name, options)]
+        partner = self.lobby.join(client, (mode, size, ships), (name, options))
+        if partner is None:
+            return []
+        partner, (partner_name, partner_options) = partner
+        match = Match(self.next_match_id, mode, size, ships)
+        self.matches[match.match_id] = match
+        self.next_match_id += 1
+        return [self.join(match, partner, partner_name, partner_options),
+                self.join(match, client, name, options)]
+
+    def join(self, match, client, name, options):
+        protocol = PROTOCOL_BINARY if PROTOCOL_BINARY in options else PROTOCOL_STRING
+        player_id = 1 if 0 in match.players.values() else 0
+        match.players[client] = player_id
+        session = Session(name, player_id, match, protocol)
+        self.sessions[client] = session
+        if self.eventlog:
+            self.eventlog.append(match.match_id, EV_LOGIN, player_id, match.size, name=name)
+        if self.broadcaster:
+            self.broadcaster.login(match.match_id, player_id, name, match.size)
+        return client, session
+
+    def logout(self, client):
+        session = self.sessions.pop(client)
+        self.admission.inflight.pop(client, None)
+        match = session.match
+        match.players.pop(client, None)
+        if self.eventlog:
+            self.eventlog.append(match.match_id, EV_LOGOUT, session.player_id, name=session.name)
+        if not match.players:
+            # last player left, forget about the match.
+            del self.matches[match.match_id]
+            if self.eventlog:
+                self.eventlog.close(match.match_id)
+            if self.broadcaster:
+                self.broadcaster.end(match.match_id)
+        return session
         
-    async def send_coordinates_to_defender(self, request):
-        # Wait until defender said she is ready
-        logger.debug("Waiting for defender to get ready...")
-        cmd, value = await self.Q_attacker.get()
-        assert cmd==STATUS and value==READY
-        logger.debug("Defender appearst to be ready.")
-        x = request[1]
-        y = request[2]
-        logger.debug(f"Will send the coords {x}, {y} to defender")
-        await self.Q_defender.put((COORDS, (x,y)))
-        # notify the attacker the coords are sent.
-        client = self.client_attacker
-        reply = Server.enc([ATTACK, OK])
-        logger.debug("Notify attacker coordinates are sent.")
-        self.frontend.send_multipart([client, b"", *reply])
-        logger.debug("END of send_coordinates")
-
-    async def recv_coordinates_from_attacker(self):
-        # Tell attacker we're ready to receive.
-        logger.debug("Tell attacker defender is ready")
-        await self.Q_attacker.put((STATUS,READY))
-        logger.debug("Defender ready, and waiting for coordinates.")
-        # Wait for the coordinates:
-        cmd, value = await self.Q_defender.get()
-        assert cmd == COORDS
-        logger.debug(f"Received the coordinates {value}")
-        # Send the coordinates to the defender
-        client = self.client_defender
-        reply = Server.enc([DEFEND, *value])
-        logger.debug(f"Reply to defender: {reply}")
-        self.frontend.send_multipart([client, b"", *reply])
-        logger.debug("END of recv_coordinates")
-
-    async def send_result_to_attacker(self):
-        # Tell defender we're ready to receive.
-        await self.Q_defender.put((STATUS,READY))
-        logger.debug("Defender knows we're ready")
-        cmd, value = await self.Q_attacker.get()
-        assert cmd==DEFEND_REQ_RESULT
-        reply = Server.enc([ATTACK_REQ_RESULT, value])
-        client = self.client_attacker
-        logger.debug(f"Reply to attacker : {reply}")
-        self.frontend.send_multipart([client, b"", *reply])
-        logger.debug("END of send_result_to_attacker")
-        
-    async def recv_result_from_defender(self, request):
-        cmd, value = await self.Q_defender.get()
-        assert cmd==STATUS and value==READY
-        logger.debug(f"Attacker is ready to find out the result, sending {request}")
-        await self.Q_attacker.put(request)
-        # notify the defender the result is sent
-        client = self.client_defender
-        reply = Server.enc([DEFEND_REQ_RESULT, OK])
-        logger.debug(f"Reply to defender: {reply}")
-        self.frontend.send_multipart([client, b"", *reply])
-        logger.debug("END of recv_result_from_defender")
+    def attack(self, client, match, request):
+        try:
+            cells = parse_cells([request[1:3]], match.size)
+        except ValueError as e:
+            logger.warning(f"Attack refused (match {match.match_id}): {e}")
+            self.reply(client, [ATTACK, ERROR])
+            return
+        if self.recording:
+            self.record_shots(match, match.players[client], cells)
+        match.client_attacker = client
+        match.shots = request[1:3]
+        self.exchange_shot(match)
+
+    def defend(self, client, match):
+        match.client_defender = match.incoming_client = client
+        self.exchange_shot(match)
+
+    def exchange_shot(self, match):
+        """Hands the shot of the attacker to the defender, once both asked (classic turns)."""
+        if match.shots is None or match.incoming_client is None:
+            return
+        logger.debug(f"Shot {match.shots} of match {match.match_id} handed to the defender.")
+        self.reply(match.client_attacker, [ATTACK, OK])
+        self.reply(match.incoming_client, [DEFEND, *match.shots])
+        match.shots = match.incoming_client = None
+
+    def attack_result(self, client, match):
+        match.client_attacker = match.shooter = client
+        self.exchange_result(match)
+
+    def defend_result(self, client, match, request):
+        try:
+            if len(request) != 2:
+                raise ValueError(f"{len(request) - 1} results instead of one.")
+            results = parse_results(request[1:])
+        except ValueError as e:
+            logger.warning(f"Result refused (match {match.match_id}): {e}")
+            self.reply(client, [DEFEND_REQ_RESULT, ERROR])
+            return
+        if self.recording:
+            self.record_results(match, match.players[client], results)
+        match.client_defender = client
+        match.result = request[1]
+        self.exchange_result(match)
+
+    def exchange_result(self, match):
+        """Hands the result of the defender to the attacker, once both asked (classic turns)."""
+        if match.result is None or match.shooter is None:
+            return
+        logger.debug(f"Result {match.result} of match {match.match_id} handed to the attacker.")
+        self.reply(match.client_defender, [DEFEND_REQ_RESULT, OK])
+        self.reply(match.shooter, [ATTACK_REQ_RESULT, match.result])
+        match.result = match.shooter = None
+
+    def record_shots(self, match, player, cells):
+        for ix, iy in cells:
+            match.targets.append((ix, iy))
+            if self.eventlog:
+                self.eventlog.append(match.match_id, EV_SHOT, player, ix, iy)
+            if self.broadcaster:
+                self.broadcaster.event(match.match_id, EV_SHOT, player, ix, iy)
+
+    def record_results(self, match, player, results):
+        for r in results:
+            ix, iy = match.targets.pop(0) if match.targets else (-1, -1)
+            if self.eventlog:
+                self.eventlog.append(match.match_id, EV_RESULT, player, ix, iy, r)
+            if self.broadcaster:
+                self.broadcaster.event(match.match_id, EV_RESULT, player, ix, iy, r)
+            
+    def report_results(self, match, results):
+        if not results:
+            return
+        if match.shooter is None:
+            logger.warning(f"Results {results} reported, but nobody is waiting for them (match {match.match_id}).")
+            return
+        self.reply(match.shooter, [SHOT, *results])
+        match.shooter = None
         
+    def report(self, client, match, request):
+        coords, results = protocol.split_args(request[1:])
+        try:
+            values = parse_results(results)
+        except ValueError as e:
+            logger.warning(f"Report refused (match {match.match_id}): {e}")
+            self.reply(client, [REPORT, ERROR])
+            return
+        if self.recording:
+            self.record_results(match, match.players[client], values)
+        self.report_results(match, results)
+        self.reply(client, [REPORT, OK])
+
+    def shot(self, client, match, request):
+        # the results of the previous shots ride along with the next shots.
+        coords, results = protocol.split_args(request[1:])
+        try:
+            cells = parse_cells(coords, match.size)
+            values = parse_results(results)
+        except ValueError as e:
+            logger.warning(f"Shots refused (match {match.match_id}): {e}")
+            self.reply(client, [SHOT, ERROR])
+            return
+        if self.recording:
+            player = match.players[client]
+            self.record_results(match, player, values)
+            self.record_shots(match, player, cells)
+        self.report_results(match, results)
+        shots = [i for xy in coords for i in xy]
+        if match.incoming_client is not None:
+            self.reply(match.incoming_client, [INCOMING, *shots])
+            match.incoming_client = None
+        else:
+            match.shots = shots
+        match.shooter = client
+
+    def fleet(self, client, match, request):
+        player = match.players[client]
+        try:
+            coords = [(protocol.row_index(x), int(y)) for x, y in protocol.split_args(request[1:])[0]]
+            if match.mode != TURN_SERVER:
+                raise ValueError("The server does not keep the boards in this match.")
+            layout = layout_from_ends(list(zip(coords[0::2], coords[1::2])), match.ships, match.size)
+            validate_fleet(layout, match.ships, match.size)
+        except ValueError as e:
+            logger.warning(f"Fleet of player {player} refused (match {match.match_id}): {e}")
+            self.reply(client, [FLEET, ERROR])
+            return
+        board = make_field(match.size, match.ships)
+        for ship, (ix, iy, direction) in enumerate(layout):
+            board.add(ix+1, iy+1, ship, direction)
+        match.boards[player] = board
+        if None in match.boards:
+            match.fleet_client = client
+            return
+        # both fleets are in: let the game begin.
+        self.reply(client, [FLEET, OK])
+        if match.fleet_client is not None:
+            self.reply(match.fleet_client, [FLEET, OK])
+            match.fleet_client = None
+
+    def resolve(self, client, match, request):
+        """Resolves the shots of a SHOT request on the board of the defender."""
+        player = match.players[client]
+        board = match.boards[1 - player]
+        if player != match.turn or board is None:
+            self.reply(client, [SHOT, ERROR])
+            return
+        coords = protocol.split_args(request[1:])[0]
+        try:
+            cells = parse_cells(coords, match.size)
+        except ValueError:
+            self.reply(client, [SHOT, ERROR])
+            return
+        results = []
+        for ix, iy in cells:
+            result = board.check_attacked_coordinates(ix, iy)
+            board.process_result(result, ix, iy)
+            results.append("%d" % (result))
+            if result == 3:
+                coords = coords[:len(results)]
+                break
+        if self.recording:
+            self.record_shots(match, player, cells[:len(results)])
+            self.record_results(match, 1 - player, [int(r) for r in results])
+        self.reply(client, [SHOT, *results])
+        match.turn = 1 - player
+        shots = [i for xy in coords for i in xy] + results
+        if match.incoming_client is not None:
+            self.reply(match.incoming_client, [INCOMING, *shots])
+            match.incoming_client = None
+        else:
+            match.shots = shots
+            # the shooter has its results already, and may ask for incoming shots first.
+            match.shooter = client
+
+    def incoming(self, client, match):
+        if match.shots is not None and client != match.shooter:
+            self.reply(client, [INCOMING, *match.shots])
+            match.shots = None
+        else:
+            match.incoming_client = client
+
+    def abandon(self, match, reason):
+        """Ends a match that got stuck, and logs out its players."""
+        logger.warning(f"Ending match {match.match_id}: {reason}.")
+        for client in list(match.players):
+            session = self.sessions[client]
+            if session.pending is not None:
+                self.reply(client, [session.pending, ERROR])
+            self.logout(client)
+        self.reaped += 1
+
+    def reap(self):
+        """Ends the matches that timed out, and sends away who waited too long in the lobby."""
+        now = time.monotonic()
+        if self.lobby_timeout:
+            for client, (name, options) in self.lobby.expire(self.lobby_timeout):
+                logger.info(f"Player {name} waited too long in the lobby.")
+                self.send(client, self.enc([LOGIN, LOGIN_ERROR, ""]))
+        stuck = {}
+        if self.idle_timeout:
+            for session in self.sessions.values():
+                if session.pending is None and now - session.t_seen > self.idle_timeout:
+                    stuck[session.match] = f"player {session.name} went silent"
+        if self.turn_timeout:
+            for match in self.matches.values():
+                if now - match.t_progress > self.turn_timeout:
+                    stuck[match] = "no progress"
+        for match, reason in stuck.items():
+            self.abandon(match, reason)
+        self.admission.prune()
+
+    async def run_reaper(self, interval=1):
+        while True:
+            await asyncio.sleep(interval)
+            self.reap()
+
+    async def report_lobby(self, interval=10):
+        paired = self.lobby.paired
+        while True:
+            await asyncio.sleep(interval)
+            if self.lobby.depth() or self.lobby.paired != paired:
+                logger.info(self.lobby.status())
+                paired = self.lobby.paired
+
     async def monitor_frontend(self, test=False):
         if test:
             self.start_test_clients()
-        n_players = 0
+        if self.eventlog:
+            self.tasks.add(asyncio.create_task(self.eventlog.run_flusher()))
+        if self.broadcaster:
+            self.tasks.add(asyncio.create_task(self.broadcaster.run()))
+        self.tasks.add(asyncio.create_task(self.report_lobby()))
+        self.tasks.add(asyncio.create_task(self.run_reaper()))
+        if self.metrics:
+            self.tasks.add(asyncio.create_task(self.metrics.serve(self.metrics_port)))
         
         while True:
             sockets = dict(await self.poller.poll())
             if self.frontend in sockets:
-                client, empty, *request = await self.frontend.recv_multipart()
-                request = self.dec(request)
-                
-                if request[0] == LOGIN:
-                    if n_players==2:
-                        # already two players logged in.
-                        reply = [LOGIN, LOGIN_ERROR, ""]
-                        reply = self.enc(reply)
-                        self.frontend.send_multipart([client, b"", *reply])
-                    else:
-                        reply = [LOGIN, LOGIN_OK, "%d"%(n_players)]
-                        reply = self.enc(reply)
-                        self.frontend.send_multipart([client, b"", *reply])
-                        n_players+=1
-                        logger.info(f"Player {request[1]} logged in.")
-                        
-                elif request[0] == ATTACK:
-                    self.client_attacker = client
-                    t = asyncio.create_task(self.send_coordinates_to_defender(request))
-                elif request[0] == DEFEND:
-                    self.client_defender = client
-                    t = asyncio.create_task(self.recv_coordinates_from_attacker())
-                elif request[0] == ATTACK_REQ_RESULT:
-                    t = asyncio.create_task(self.send_result_to_attacker())
-                elif request[0] == DEFEND_REQ_RESULT:
-                    t = asyncio.create_task(self.recv_result_from_defender(request))
-                elif request[0] == LOGOUT:
-                    n_players-=1
-                    reply = [LOGOUT, LOGOUT_OK, ""]
-                    reply = self.enc(reply)
-                    self.frontend.send_multipart([client, b"", *reply])
-                    logger.info(f"Player {request[1]} logged out.")
+                for client, request, overloaded in await self.receive_batch():
+                    try:
+                        self.handle(client, request, overloaded)
+                    except Exception as e:
+                        # one bad request must not take the other matches down with it.
+                        logger.warning(f"Request {request[0]} failed: {e!r}")
+                        if self.admission.inflight.get(client):
+                            self.reply(client, [request[0], ERROR])
                         
         # Clean up, but we don't get here anyway.
         self.frontend.close()
         self.context.term()
 
+    async def receive_batch(self):
+        """Takes up to RECEIVE_BATCH requests from the socket, the ones to handle first first.
+
+        Returns (client, request, overloaded) for every request, where
+        overloaded tells whether the batch was full. Requests that cannot
+        be decoded are answered with ERROR, and left out.
+        """
+        batch = [await self.frontend.recv_multipart()]
+        while len(batch) < RECEIVE_BATCH:
+            try:
+                batch.append(await self.frontend.recv_multipart(flags=zmq.NOBLOCK))
+            except zmq.Again:
+                break
+        overloaded = len(batch) == RECEIVE_BATCH
+        requests = []
+        for client, *request in batch:
+            try:
+                request = protocol.decode(request[1:])
+            except ValueError as e:
+                logger.warning(f"Malformed request: {e}")
+                self.frontend.send_multipart([client, b"", *self.enc([ERROR])])
+                continue
+            if self.paired(request):
+                priority = 0
+            elif client not in self.sessions:
+                priority = 2
+            elif request[0] == HEARTBEAT:
+                priority = 1
+            else:
+                priority = 0
+            requests.append((priority, client, request))
+        requests.sort(key=lambda r: r[0]) # stable: in order of arrival otherwise
+        return [(client, request, overloaded) for priority, client, request in requests]
+
+    def paired(self, request):
+        """Whether request is a LOGIN of a worker that the front end paired into a match."""
+        return (self.sharded and request[0] == LOGIN
+                and any(option.startswith(OPTION_MATCH) for option in request[2:]))
 
+    def handle(self, client, request, overloaded=False):
+        session = self.sessions.get(client)
+        if self.paired(request):
+            pass # answering BUSY would leave its partner in a match of one.
+        elif session is None and overloaded:
+            self.admission.refuse(client, "the server is overloaded")
+            self.busy(client, request[0])
+            return
+        elif not self.admission.admit(client, session and session.match.players):
+            self.busy(client, request[0])
+            return
+        if self.metrics:
+            # junk opcodes share one label, or every one of them would make new series.
+            label = request[0] if request[0] in protocol.OPCODE_IDS else UNKNOWN_OPCODE
+            self.metrics.request(label)
+            self.t_request[client] = (label, time.perf_counter())
+
+        if request[0] not in protocol.OPCODE_IDS:
+            logger.warning(f"Unknown request {request[0]!r}.")
+            self.send(client, self.enc([request[0], ERROR]))
+            return
+
+        if request[0] == LOGIN:
+            name = request[1] if len(request) > 1 else None
+            try:
+                if name is None:
+                    raise ValueError("no name given")
+                joined = self.login(client, name, request[2:])
+            except ValueError as e:
+                logger.warning(f"Player {name} cannot log in: {e}")
+                self.send(client, self.enc([LOGIN, LOGIN_ERROR, ""]))
+                return
+            if not joined:
+                logger.info(f"Player {name} waits in the lobby.")
+            for c, session in joined:
+                # The LOGIN reply always uses the string protocol.
+                reply = [LOGIN, LOGIN_OK, "%d"%(session.player_id), "%d"%(session.match.match_id),
+                         *session.accepted()]
+                self.send(c, self.enc(reply))
+                logger.info(f"Player {session.name} logged in (match {session.match.match_id}).")
+            return
+
+        session = self.sessions.get(client)
+        if session is None:
+            logger.warning(f"Request {request[0]} from a client that is not logged in.")
+            self.reply(client, [request[0], ERROR])
+            return
+        match = session.match
+        session.t_seen = time.monotonic()
+        session.pending = request[0]
+        if request[0] == HEARTBEAT:
+            self.reply(client, [HEARTBEAT, OK])
+            return
+        match.t_progress = session.t_seen
+
+        if request[0] == ATTACK:
+            self.attack(client, match, request)
+        elif request[0] == DEFEND:
+            self.defend(client, match)
+        elif request[0] == ATTACK_REQ_RESULT:
+            self.attack_result(client, match)
+        elif request[0] == DEFEND_REQ_RESULT:
+            self.defend_result(client, match, request)
+        elif request[0] == SHOT and match.mode == TURN_SERVER:
+            self.resolve(client, match, request)
+        elif request[0] == SHOT:
+            self.shot(client, match, request)
+        elif request[0] == FLEET:
+            self.fleet(client, match, request)
+        elif request[0] == INCOMING:
+            self.incoming(client, match)
+        elif request[0] == REPORT:
+            self.report(client, match, request)
+        elif request[0] == LOGOUT:
+            self.reply(client, [LOGOUT, LOGOUT_OK, ""])
+            self.logout(client)
+            logger.info(f"Player {session.name} logged out (match {match.match_id}).")
+
+    def close(self):
+        """Cancels the tasks of the server and closes its sockets, once it is stopped."""
+        for t in self.tasks:
+            t.cancel()
+        self.frontend.close(linger=0)
+        if self.broadcaster:
+            self.broadcaster.socket.close(linger=0)
+
+
+def serve(endpoint=None, **options):
+    """Runs a single process server until it is interrupted."""
+    s = Server(endpoint, **options)
+    try:
+        asyncio.run(s.monitor_frontend(test=False))
+    except KeyboardInterrupt:
+        pass
+
+
+class ServerThread():
+    """A Server on an event loop of its own, in a background thread.
+
+    For clients in the same process as the server: bots, tests and
+    simulations. With the default endpoint, LOCAL_ENDPOINT (inproc://),
+    messages between the clients and the server never leave the process;
+    clients reach the server by passing the endpoint to ZMQClient,
+    AsyncPlayer.login or client_task. options are passed on to Server.
+
+    start() returns once the server is bound, and stop() cancels it and
+    waits for the thread to end. A ServerThread is a context manager as
+    well:
+
+        with ServerThread() as server:
+            player.login(endpoint=server.endpoint)
+    """
+    def __init__(self, endpoint=LOCAL_ENDPOINT, **options):
+        self.endpoint = endpoint
+        self.options = options
+        self.server = None
+        self.loop = None
+        self.task = None
+        self.thread = None
+        self.ready = threading.Event()
+        self.error = None # raised by start(), if the server could not start
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),), name="battleships-server",
+                                       daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+        return self
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        try:
+            self.server = Server(self.endpoint, **self.options)
+        except Exception as e:
+            # e.g. the endpoint is in use; let start() raise it.
+            self.error = e
+            return
+        finally:
+            self.ready.set()
+        try:
+            await self.server.monitor_frontend()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.server.close()
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.task.cancel)
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def run_worker(worker, backend=BACKEND, **options):
+    fmt = f"[%(levelname)6s] worker {worker}: %(message)s"
+    logging.basicConfig(level=logging.WARNING, format=fmt)
+    logger.setLevel(logging.INFO)
+    if options.get("metrics_port"):
+        # every worker serves its own metrics, next to the port of the server.
+        options["metrics_port"] += worker + 1
+    s = Server(backend, worker=worker, **options)
+    asyncio.run(s.monitor_frontend())
+
+    
 def main():        
+    description='''
+Battleships server
+
+    Hosts games of Battleships for any number of pairs of players.
+'''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-p', '--port', type=int, default=PORT)
+    parser.add_argument('--endpoint', default=None,
+                        help='Bind to this zmq endpoint instead of tcp://*:PORT, e.g. "ipc:///tmp/battleships" for clients on the same machine.')
+    parser.add_argument('-w', '--workers', type=int, default=0,
+                        help='Run a front end that shares the matches over this many worker processes. By default, everything runs in one process.')
+    parser.add_argument('--worker', type=int, default=None,
+                        help='Only run worker WORKER, connecting to the back end of a front end that is already running (for restarting a worker).')
+    parser.add_argument('--frontend-only', action='store_true',
+                        help='Only run the front end; start the workers with --worker.')
+    parser.add_argument('--backend', default=BACKEND, help=f'Endpoint between front end and workers. Defaults to "{BACKEND}".')
+    parser.add_argument('--log-dir', default=None, help='Write the events of all matches to this directory (see battleships_replay).')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help=f'Serve metrics in the Prometheus text format on this port of localhost. Defaults to {METRICS_PORT}; worker N of a sharded server uses the port plus N+1.')
+    parser.add_argument('--no-metrics', action='store_true', help='Do not collect metrics.')
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help=f'End a match when a player that is not waiting for a reply sends nothing, not even a heartbeat, for this many seconds. Defaults to {IDLE_TIMEOUT}; 0 turns it off.')
+    parser.add_argument('--turn-timeout', type=float, default=TURN_TIMEOUT,
+                        help=f'End a match that makes no progress for this many seconds. Defaults to {TURN_TIMEOUT}; 0 turns it off.')
+    parser.add_argument('--lobby-timeout', type=float, default=LOBBY_TIMEOUT,
+                        help=f'Send away players that waited this many seconds for an opponent. Defaults to {LOBBY_TIMEOUT}; 0 turns it off.')
+    parser.add_argument('--spectate-port', type=int, default=SPECTATE_PORT,
+                        help=f'Publish the matches for spectators on this port (see battleships_spectate). Defaults to {SPECTATE_PORT}; 0 turns it off.')
+    parser.add_argument('--client-inflight', type=int, default=CLIENT_INFLIGHT,
+                        help=f'Answer BUSY to a client with this many requests not replied to yet. Defaults to {CLIENT_INFLIGHT}.')
+    parser.add_argument('--match-inflight', type=int, default=MATCH_INFLIGHT,
+                        help=f'Answer BUSY to the players of a match with this many requests not replied to yet. Defaults to {MATCH_INFLIGHT}.')
+    parser.add_argument('--client-rate', type=float, default=CLIENT_RATE,
+                        help=f'Answer BUSY to a client that sends more than this many requests per second, on average. Defaults to {CLIENT_RATE}.')
+    args = parser.parse_args()
+    admission = Admission(args.client_inflight, args.match_inflight, args.client_rate,
+                          max(CLIENT_BURST, args.client_rate/5))
+    options = dict(log_dir=args.log_dir, idle_timeout=args.idle_timeout,
+                   turn_timeout=args.turn_timeout, lobby_timeout=args.lobby_timeout, admission=admission)
+    if not args.no_metrics:
+        options["metrics_port"] = args.metrics_port
+    spectate = "tcp://*:%d" % (args.spectate_port) if args.spectate_port else None
+    # the workers of a sharded server publish through the front end.
+    worker_options = dict(options, spectate=spectate and PUBLISH_BACKEND)
+
     fmt = "[%(levelname)6s] %(message)s"
     logging.basicConfig(level=logging.WARNING, format=fmt)
     logger.setLevel(logging.INFO)        
-    s = Server()
-    asyncio.run(s.monitor_frontend(test=False))
+    if args.worker is not None:
+        run_worker(args.worker, args.backend, **worker_options)
+    elif args.workers or args.frontend_only:
+        from .frontend import FrontEnd
+        logging.getLogger(FrontEnd.__module__).setLevel(logging.INFO)
+        frontend = FrontEnd(max(1, args.workers), args.endpoint or "tcp://*:%d" % (args.port), args.backend,
+                            worker_options, spectate=spectate, lobby_timeout=args.lobby_timeout,
+                            route_timeout=args.turn_timeout and 2*args.turn_timeout)
+        frontend.run(spawn_workers=not args.frontend_only)
+    else:
+        serve(args.endpoint or "tcp://*:%d" % (args.port), spectate=spectate, **options)
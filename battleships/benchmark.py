@@ -0,0 +1,390 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from . import __version__
+from .battleships_data import *
+from .battleships import Field, AsyncPlayer
+from .bitboard import BitField
+from .sparse import SparseField, DENSE_FIELD
+from .placement import random_fleet, place_fleet
+from .renderer import Renderer
+from .admission import Admission
+
+import logging
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = {} # name -> function(repeat, number) returning samples, in seconds per operation
+# seconds the import of a client (battleships.battleships) may take, and the
+# modules it must not import: they are only needed to draw or to vectorize.
+IMPORT_BUDGET = 0.3
+HEAVY_MODULES = ("numpy", "termcolor")
+BACKENDS = (Field, BitField, SparseField)
+DENSE_BACKENDS = (Field, BitField) # candidates for DENSE_FIELD
+CELLS = [(ix, iy) for ix in range(Field.SIZE) for iy in range(Field.SIZE)]
+
+
+def benchmark(name):
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def fleets(n, seed=0):
+    rng = random.Random(seed)
+    return [random_fleet(rng) for i in range(n)]
+
+
+def placed(cls, n):
+    fields = []
+    for fleet in fleets(n):
+        field = cls()
+        place_fleet(field, fleet)
+        fields.append(field)
+    return fields
+
+
+def timed(repeat, setup, run, operations):
+    """Samples of the time per operation of run(setup()), one per repeat.
+
+    setup is not timed; run does operations operations.
+    """
+    samples = []
+    for i in range(repeat):
+        state = setup()
+        t0 = time.perf_counter()
+        run(state)
+        samples.append((time.perf_counter() - t0)/operations)
+    return samples
+
+
+for cls in BACKENDS:
+    def add(repeat, number, cls=cls):
+        def run(state):
+            for field, fleet in state:
+                place_fleet(field, fleet)
+        return timed(repeat, lambda: [(cls(), fleet) for fleet in fleets(number)], run,
+                     number*len(Field.SHIPS))
+
+    def check(repeat, number, cls=cls):
+        def run(fields):
+            for field in fields:
+                for ix, iy in CELLS:
+                    field.check_attacked_coordinates(ix, iy)
+        return timed(repeat, lambda: placed(cls, number), run, number*len(CELLS))
+
+    def process(repeat, number, cls=cls):
+        rng = random.Random(0)
+        results = [(rng.choice((0, 1, 2)), ix, iy) for ix, iy in CELLS]
+        def run(fields):
+            for field in fields:
+                for result, ix, iy in results:
+                    field.process_result(result, ix, iy)
+        return timed(repeat, lambda: placed(cls, number), run, number*len(CELLS))
+
+    benchmark(f"add[{cls.__name__}]")(add)
+    benchmark(f"check_attacked_coordinates[{cls.__name__}]")(check)
+    benchmark(f"process_result[{cls.__name__}]")(process)
+
+
+def shot_fields(size=Field.SIZE, cls=Field, shots=30):
+    """Two fields of size with a random fleet and some shots marked."""
+    rng = random.Random(0)
+    fields = []
+    for i in range(2):
+        field = cls(size)
+        place_fleet(field, random_fleet(rng, field.SHIPS, size))
+        for j in range(shots):
+            field.process_result(rng.choice((0, 1)), rng.randrange(size), rng.randrange(size))
+        fields.append(field)
+    return fields
+
+
+@benchmark("Player.draw")
+def player_draw(repeat, number):
+    player = AsyncPlayer(*shot_fields(), name="benchmark")
+    player.renderer = None # plain prints, as on a stream that is not a terminal
+    def run(out):
+        with contextlib.redirect_stdout(out):
+            for i in range(number):
+                player.draw()
+    return timed(repeat, io.StringIO, run, number)
+
+
+def renderer_benchmark(size, cls, full):
+    def bench(repeat, number):
+        fields = shot_fields(size, cls)
+        renderer = Renderer(io.StringIO())
+        cells = itertools.cycle(CELLS)
+        def run(state):
+            for i in range(number):
+                if full:
+                    renderer.invalidate()
+                else:
+                    ix, iy = next(cells)
+                    fields[0].process_result(0, ix, iy)
+                renderer.draw(*fields, viewport=(0, 0, 20, 20))
+                renderer.stream.seek(0)
+                renderer.stream.truncate()
+        return timed(repeat, lambda: None, run, number)
+    return bench
+
+
+benchmark("Renderer.draw[full]")(renderer_benchmark(Field.SIZE, Field, True))
+benchmark("Renderer.draw[update]")(renderer_benchmark(Field.SIZE, Field, False))
+benchmark("Renderer.draw[update,1000x1000]")(renderer_benchmark(1000, SparseField, False))
+
+
+def imported(module):
+    """Seconds the import of module takes in a new interpreter, and the HEAVY_MODULES it imported."""
+    code = (f"import sys, time; t = time.perf_counter(); import {module}; t = time.perf_counter() - t; "
+            f"print(t, *[m for m in {HEAVY_MODULES!r} if m in sys.modules])")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root] + sys.path))
+    t, *heavy = subprocess.check_output([sys.executable, "-c", code], env=env).split()
+    return float(t), [m.decode() for m in heavy]
+
+
+def import_benchmark(module):
+    def bench(repeat, number):
+        return [imported(module)[0] for i in range(repeat)]
+    return bench
+
+
+for module in ("battleships.battleships", "battleships.battleships_server"):
+    benchmark(f"import[{module}]")(import_benchmark(module))
+
+
+def check_imports(results, budget=IMPORT_BUDGET):
+    """Checks the import of a client against budget (seconds) and HEAVY_MODULES.
+
+    Returns the problems found, as lines of text; the import time is only
+    checked if it is in results.
+    """
+    problems = []
+    name = "import[battleships.battleships]"
+    result = results["results"].get(name)
+    if result and result["median"] > budget:
+        problems.append(f"{name} takes {result['median']*1e3:.0f} ms, more than the budget of {budget*1e3:.0f} ms.")
+    for module in ("battleships.battleships", "battleships.battleships_server"):
+        t, heavy = imported(module)
+        if heavy:
+            problems.append(f"{module} imports {', '.join(heavy)}.")
+    return problems
+
+
+def check_backends(results, threshold=0.1):
+    """Checks that DENSE_FIELD is the fastest of DENSE_BACKENDS to play on.
+
+    Playing a shot is a check_attacked_coordinates and a process_result;
+    DENSE_FIELD may take at most threshold (a fraction) longer for them
+    than another backend. Returns the problems found, as lines of text;
+    backends without both results are not compared.
+    """
+    def shot(cls):
+        names = [f"{op}[{cls.__name__}]" for op in ("check_attacked_coordinates", "process_result")]
+        if all(name in results["results"] for name in names):
+            return sum(results["results"][name]["median"] for name in names)
+    problems = []
+    t = shot(DENSE_FIELD)
+    for cls in DENSE_BACKENDS:
+        other = shot(cls)
+        if t is not None and other is not None and t > (1 + threshold)*other:
+            problems.append(f"{DENSE_FIELD.__name__} plays a shot in {t*1e6:.2f} us, {cls.__name__} in "
+                            f"{other*1e6:.2f} us: make {cls.__name__} DENSE_FIELD.")
+    return problems
+
+
+@benchmark("HeatmapStrategy move")
+def heatmap_move(repeat, number):
+    from .strategies import HeatmapStrategy, play_solo
+    samples = []
+    for field in placed(Field, repeat):
+        shots, dt = play_solo(HeatmapStrategy(seed=0), field)
+        samples.append(dt/shots)
+    return samples
+
+
+def turn_benchmark(transport, mode):
+    """Turns of complete games of two clients with a Server in this process.
+
+    The samples are the times of the attack turns, from the first request
+    of the attacker to the reply that completes its turn.
+    """
+    def bench(repeat, number):
+        from .battleships_server import Server, client_task
+        from .loadtest import LatencyStats
+        stats = LatencyStats()
+        if transport == "inproc":
+            endpoint = f"inproc://battleships-benchmark-{mode}"
+        else:
+            endpoint = f"ipc:///tmp/battleships-benchmark-{os.getpid()}-{mode}"
+
+        async def run():
+            server = Server(endpoint)
+            task = asyncio.create_task(server.monitor_frontend())
+            try:
+                options = dict(single=mode == TURN_SINGLE, server_boards=mode == TURN_SERVER)
+                await asyncio.gather(*[client_task(f"benchmark-{i}", stats, games=repeat, delay=0,
+                                                   endpoint=endpoint, **options) for i in range(2)])
+            finally:
+                task.cancel()
+                for t in server.tasks:
+                    t.cancel()
+                server.frontend.close(linger=0)
+                if transport == "ipc" and os.path.exists(endpoint[len("ipc://"):]):
+                    os.remove(endpoint[len("ipc://"):])
+
+        asyncio.run(run())
+        return stats.samples["turn"]
+    return bench
+
+
+for transport in ("inproc", "ipc"):
+    for mode in ("classic", TURN_SINGLE, TURN_SERVER):
+        benchmark(f"turn[{transport},{mode}]")(turn_benchmark(transport, mode))
+
+
+class Replies(list):
+    """Stands in for the socket of a Server, keeping the frames it sends."""
+    def send_multipart(self, frames):
+        self.append(frames)
+
+    def close(self, linger=None):
+        pass
+
+
+@benchmark("rendezvous[classic]")
+def rendezvous(repeat, number):
+    """Turns of a classic match, handled by a Server without sockets or clients.
+
+    Every turn is the four requests of the classic protocol, sent as the
+    clients would: each one only once its previous request is answered.
+    """
+    from .battleships_server import Server
+    attacker, defender = b"attacker", b"defender"
+    turn = [[(defender, [DEFEND]), (attacker, [ATTACK, "1", "2"])],
+            [(attacker, [ATTACK_REQ_RESULT]), (defender, [DEFEND_REQ_RESULT, "0"])]]
+
+    async def run():
+        # no rate limits: the requests come much faster than from real clients.
+        admission = Admission(client_rate=1e9, client_burst=1e9)
+        server = Server(f"inproc://battleships-rendezvous-{os.getpid()}", admission=admission)
+        server.frontend.close(linger=0)
+        server.frontend = replies = Replies()
+        for client in (attacker, defender):
+            server.login(client, client.decode())
+        samples = []
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            for j in range(number):
+                for requests in turn:
+                    for client, request in requests:
+                        server.handle(client, request)
+                    while len(replies) < 2:
+                        await asyncio.sleep(0)
+                    replies.clear()
+            samples.append((time.perf_counter() - t0)/number)
+        server.close()
+        return samples
+
+    return asyncio.run(run())
+
+
+def summary(samples):
+    samples = sorted(samples)
+    return dict(median=statistics.median(samples), min=samples[0], mean=statistics.fmean(samples),
+                p95=samples[min(len(samples)-1, int(0.95*len(samples)))], samples=len(samples))
+
+
+def run(names, repeat=5, number=100):
+    """Runs the benchmarks names; returns the results, as saved in JSON."""
+    results = {}
+    for name in names:
+        t0 = time.perf_counter()
+        results[name] = summary(BENCHMARKS[name](repeat, number))
+        logger.info(f"{name}: {results[name]['median']*1e6:.2f} us ({time.perf_counter() - t0:.1f} s)")
+    return dict(version=__version__, python=platform.python_version(), platform=platform.platform(),
+                time=time.strftime("%Y-%m-%dT%H:%M:%S"), repeat=repeat, number=number, results=results)
+
+
+def compare(results, baseline, threshold=0.1):
+    """Compares the medians of results with those of baseline.
+
+    Returns the lines of a report and the names of the benchmarks that
+    got slower by more than threshold (a fraction).
+    """
+    lines = [f"  {'benchmark':40s} {'baseline us':>12s} {'now us':>12s} {'change':>8s}"]
+    slower = []
+    for name, result in results["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            lines.append(f"  {name:40s} {'':>12s} {result['median']*1e6:12.2f}      new")
+            continue
+        change = result["median"]/base["median"] - 1
+        flag = ""
+        if change > threshold:
+            slower.append(name)
+            flag = "  slower"
+        lines.append(f"  {name:40s} {base['median']*1e6:12.2f} {result['median']*1e6:12.2f} {change:+8.1%}{flag}")
+    return lines, slower
+
+
+def main():
+    description='''
+Battleships benchmarks
+
+    Measures the rules engine (placing ships, resolving and marking
+    shots), drawing the fields, and complete turns through a server and
+    clients in this process, over inproc:// and ipc:// (no network
+    needed). The results can be saved as JSON and compared with a
+    baseline saved before.
+'''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-k', '--select', default=None, help='Only run the benchmarks whose name contains this text.')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Samples per benchmark, or games per benchmark of turns.')
+    parser.add_argument('-n', '--number', type=int, default=100, help='Operations per sample.')
+    parser.add_argument('-o', '--output', default=None, help='Save the results to this JSON file.')
+    parser.add_argument('--compare', default=None, help='Compare with the results in this JSON file, and exit with status 1 if a benchmark got slower.')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Fraction a benchmark may get slower before --compare fails. Defaults to 0.1.')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET,
+                        help=f'Exit with status 1 if importing the client takes longer than this many seconds, or imports {" or ".join(HEAVY_MODULES)}. Defaults to {IMPORT_BUDGET}.')
+    parser.add_argument('--list', action='store_true', help='List the benchmarks.')
+    args = parser.parse_args()
+
+    fmt = "[%(levelname)6s] %(message)s"
+    logging.basicConfig(level=logging.WARNING, format=fmt)
+    logger.setLevel(logging.INFO)
+    names = [name for name in BENCHMARKS if args.select is None or args.select in name]
+    if args.list:
+        print("\n".join(names))
+        return
+    results = run(names, args.repeat, args.number)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    problems = check_imports(results, args.import_budget) + check_backends(results, args.threshold)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, slower = compare(results, baseline, args.threshold)
+        print("\n".join(lines))
+        if slower:
+            problems.append(f"{len(slower)} benchmarks got slower by more than {args.threshold:.0%}.")
+    else:
+        for name, result in results["results"].items():
+            print(f"  {name:40s} {result['median']*1e6:12.2f} us")
+    if problems:
+        print("\n".join(problems))
+        sys.exit(1)
@@ -0,0 +1,139 @@
+from .battleships import Field
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class BitField(Field):
+    """Field backend that stores the board as integer bitboards.
+
+    Cell (ix, iy) maps onto bit ix*SIZE+iy. Ship occupancy, the cells of
+    every ship, hits and the marks written by process_result are all kept
+    as Python ints, so that hit, sink and win detection, and the overlap
+    check when placing a ship, are a couple of bitwise operations.
+
+    The public interface (add, check_attacked_coordinates, process_result,
+    mark, draw) behaves like the one of Field.
+    """
+    DIRECTIONS = dict(R=(1,0), D=(0,1), L=(-1,0), U=(0,-1))
+
+    def __init__(self, size=None, ships=None):
+        if size is not None:
+            self.SIZE = size
+        if ships is not None:
+            self.SHIPS = tuple(ships)
+        self.ships = []
+        self.occupied = 0
+        self.ship_masks = [0 for i in self.SHIPS]
+        self.hit = 0 # ship cells that have been attacked
+        # cells marked by process_result/mark, and all of them together
+        self.missed = 0
+        self.struck = 0
+        self.sunk = 0
+        self.marked = 0
+
+    def bit(self, ix, iy):
+        return 1 << (ix*self.SIZE + iy)
+    
+    def ship_mask(self, x, y, size, direction):
+        d, r = BitField.DIRECTIONS[direction]
+        x_end = x + r*(size-1)
+        y_end = y + d*(size-1)
+        for i in (x, y, x_end, y_end):
+            if i<0 or i>=self.SIZE:
+                raise ValueError('Ship out of domain')
+        step = abs(r*self.SIZE + d)
+        n = min(x, x_end)*self.SIZE + min(y, y_end)
+        # size bits, step apart: (2**(step*size) - 1)/(2**step - 1) has them at n=0.
+        return ((1 << step*size) - 1) // ((1 << step) - 1) << n
+        
+    def add(self, X,Y, ship, direction):
+        if ship in self.ships:
+            raise ValueError('Ship already placed')
+        mask = self.ship_mask(X-1, Y-1, self.SHIPS[ship], direction)
+        if mask & self.occupied:
+            raise ValueError('Overlapping ships')
+        self.occupied |= mask
+        self.ship_masks[ship] = mask
+        self.ships.append(ship)
+
+    def add_mask(self, ship, mask):
+        """Adds ship at the cells of mask, which must be a legal, free placement."""
+        self.occupied |= mask
+        self.ship_masks[ship] = mask
+        self.ships.append(ship)
+
+    def ship_at(self, b):
+        """The ship on the cell of bit b, which must be occupied."""
+        for ship, mask in enumerate(self.ship_masks):
+            if mask & b:
+                return ship
+
+    def mark(self, X,Y, value):
+        b = 1 << (X*self.SIZE + Y)
+        if self.marked & b:
+            # marked before: only a cell marked again needs clearing.
+            self.missed &= ~b
+            self.struck &= ~b
+            self.sunk &= ~b
+            self.marked &= ~b
+        if value==-1:
+            self.missed |= b
+        elif value==-2:
+            self.struck |= b
+        elif value==-3:
+            self.sunk |= b
+        else:
+            return
+        self.marked |= b
+
+    def process_result(self, result, ix, iy):
+        # as Field.process_result, without the call to mark for a cell marked for the first time.
+        b = 1 << (ix*self.SIZE + iy)
+        if self.marked & b:
+            if 0 <= result <= 3:
+                self.mark(ix, iy, (-1, -2, -2, -3)[result])
+        elif result==0:
+            self.missed |= b
+            self.marked |= b
+        elif result==1 or result==2:
+            self.struck |= b
+            self.marked |= b
+        elif result==3:
+            self.sunk |= b
+            self.marked |= b
+
+    def cell(self, X, Y):
+        b = 1 << (X*self.SIZE + Y)
+        if not (self.marked | self.occupied) & b:
+            return 0
+        elif self.sunk & b:
+            return -3
+        elif self.struck & b:
+            return -2
+        elif self.missed & b:
+            return -1
+        return self.ship_at(b) + 1
+
+    def ship_cells(self):
+        for ship, mask in enumerate(self.ship_masks):
+            m = mask & ~self.marked
+            while m:
+                low = m & -m
+                n = low.bit_length() - 1
+                yield n // self.SIZE, n % self.SIZE, ship
+                m ^= low
+
+    def check_attacked_coordinates(self, ix, iy):
+        b = 1 << (ix*self.SIZE + iy)
+        if self.marked & b:
+            return -1 # already hit: tell them they missed.
+        if not self.occupied & b:
+            return 0 # missed
+        self.hit |= b
+        if self.occupied & ~self.hit == 0:
+            return 3 # all ships hit
+        for mask in self.ship_masks:
+            if mask & b:
+                # ship sunk, or hit
+                return 2 if mask & ~self.hit == 0 else 1
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+
+from .battleships_data import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+# event types
+EV_LOGIN = 1
+EV_SHOT = 2
+EV_RESULT = 3
+EV_LOGOUT = 4
+
+# time, event, player, x, y, result, name (for EV_LOGIN)
+# EV_LOGIN has the size of the fields in x, and no y.
+RECORD = struct.Struct("!dBBiib16s")
+# files kept open between flushes, at most; the least recently written is closed first.
+OPEN_FILES = 64
+
+
+def match_path(directory, match_id):
+    return os.path.join(directory, f"match-{match_id}.log")
+
+
+class EventLog():
+    """Append-only binary log of the events of every match.
+
+    Every match has a file of its own in directory, made of fixed size
+    records (see RECORD): the logins, the shots, the results and the
+    logouts of its players. Appending only packs a record into the
+    buffer of the match. The buffers are written and fsync'ed in batches
+    by flush(), which run_flusher() calls every interval seconds in a
+    thread, so the event loop never waits for the disk. Only the files of
+    the open_files matches written most recently are kept open; the others
+    are opened again when they are written.
+    """
+    def __init__(self, directory, interval=0.2, open_files=OPEN_FILES):
+        self.directory = directory
+        self.interval = interval
+        self.open_files = open_files
+        os.makedirs(directory, exist_ok=True)
+        self.buffers = {} # match id -> bytearray
+        self.files = OrderedDict() # match id -> file, least recently written first
+        self.closing = set() # matches to close after the next flush
+
+    def next_match_id(self):
+        """First match id that has no log yet, so a restarted server does not reuse one."""
+        ids = [int(f[6:-4]) for f in os.listdir(self.directory)
+               if f.startswith("match-") and f.endswith(".log")]
+        return max(ids, default=-1) + 1
+
+    def append(self, match_id, event, player, x=-1, y=-1, result=0, name=""):
+        buf = self.buffers.get(match_id)
+        if buf is None:
+            buf = self.buffers[match_id] = bytearray()
+        buf += RECORD.pack(time.time(), event, player, x, y, result, name.encode()[:16])
+
+    def close(self, match_id):
+        """The match has ended; close its file once everything is written."""
+        self.closing.add(match_id)
+
+    def take(self):
+        """Takes the pending buffers and closes, to be written by write()."""
+        buffers, self.buffers = self.buffers, {}
+        closing, self.closing = self.closing, set()
+        return buffers, closing
+
+    def file(self, match_id):
+        f = self.files.get(match_id)
+        if f is None:
+            while len(self.files) >= self.open_files:
+                self.files.popitem(last=False)[1].close()
+            f = self.files[match_id] = open(match_path(self.directory, match_id), "ab")
+        else:
+            self.files.move_to_end(match_id)
+        return f
+
+    def write(self, buffers, closing):
+        for match_id, buf in buffers.items():
+            try:
+                f = self.file(match_id)
+                f.write(buf)
+                f.flush()
+                os.fsync(f.fileno())
+            except OSError as e:
+                logger.error(f"Lost {len(buf)//RECORD.size} events of match {match_id}: {e}")
+        for match_id in closing:
+            f = self.files.pop(match_id, None)
+            if f is not None:
+                f.close()
+
+    def flush(self):
+        self.write(*self.take())
+
+    async def run_flusher(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                if self.buffers or self.closing:
+                    # take the buffers here, so appends never race with the writer thread.
+                    try:
+                        await loop.run_in_executor(None, self.write, *self.take())
+                    except Exception as e:
+                        logger.exception(f"Writing the event log failed: {e}")
+        finally:
+            self.flush()
+
+
+class Replay():
+    """Read access to the log of one match.
+
+    The file is memory mapped, so looking at a match only reads that
+    match's records.
+    """
+    def __init__(self, directory, match_id):
+        self.match_id = match_id
+        with open(match_path(directory, match_id), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.n = len(self.mm)//RECORD.size
+
+    def __len__(self):
+        return self.n
+
+    def events(self):
+        """Yields (time, event, player, x, y, result, name) for every record."""
+        for t, event, player, x, y, result, name in RECORD.iter_unpack(memoryview(self.mm)[:self.n*RECORD.size]):
+            yield t, event, player, x, y, result, name.rstrip(b"\0").decode()
+
+    def state(self, turn=None):
+        """State of the match after turn results (all of them if turn is None).
+
+        Returns the names of the players and, per player, the Field with
+        the shots of the opponent at that player marked as Field.process_result
+        does, and the number of the turns played.
+        """
+        from .sparse import make_field
+        names = {}
+        fields = None
+        turns = 0
+        for t, event, player, x, y, result, name in self.events():
+            if event == EV_LOGIN:
+                names[player] = name
+                if fields is None:
+                    fields = [make_field(x), make_field(x)]
+            elif event == EV_RESULT:
+                if turn is not None and turns == turn:
+                    break
+                # the defender is the one reporting the result
+                fields[player].process_result(result, x, y)
+                turns += 1
+        if fields is None:
+            fields = [make_field(), make_field()]
+        return names, fields, turns
+
+
+def main():
+    description='''
+Battleships replay
+
+    Shows the fields of a match, as recorded in the event log of a
+    server, after a given number of turns.
+'''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('DIRECTORY', help='Log directory of the server (--log-dir).')
+    parser.add_argument('MATCH', type=int, help='Match id.')
+    parser.add_argument('-t', '--turn', type=int, default=None, help='Show the fields after this many turns; default is the last turn.')
+    parser.add_argument('-e', '--events', action='store_true', help='List the events too.')
+    parser.add_argument('--view', nargs=2, default=("A", "0"), metavar=('ROW', 'COLUMN'),
+                        help='On fields larger than the terminal, show the part from this cell on. Defaults to A 0.')
+    args = parser.parse_args()
+    from .protocol import row_label, row_index
+    from .renderer import viewport_size
+
+    replay = Replay(args.DIRECTORY, args.MATCH)
+    if args.events:
+        labels = {EV_LOGIN: "login", EV_SHOT: "shot", EV_RESULT: "result", EV_LOGOUT: "logout"}
+        for t, event, player, x, y, result, name in replay.events():
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+            if event in (EV_SHOT, EV_RESULT):
+                print(f"{stamp} player {player} {labels[event]:6s} {row_label(x)} {y} {result if event==EV_RESULT else ''}")
+            else:
+                print(f"{stamp} player {player} {labels[event]:6s} {name}")
+    names, fields, turns = replay.state(args.turn)
+    print(f"Match {args.MATCH} after {turns} turns.")
+    size = fields[0].SIZE
+    rows, columns = viewport_size(size, n_fields=1)
+    ix0, iy0 = row_index(args.view[0]), int(args.view[1])
+    for player in (0, 1):
+        print(f"Sea of player {player} ({names.get(player, '?')}):")
+        for row in range(ix0, min(size, ix0 + rows)):
+            fields[player].draw(row, range(iy0, min(size, iy0 + columns)))
+            print()
@@ -0,0 +1,214 @@
+import multiprocessing
+import signal
+import sys
+import time
+import zlib
+from collections import OrderedDict
+
+import zmq
+
+from .battleships_data import *
+from . import protocol
+from .battleships_server import (run_worker, worker_identity, requested_match, requested_mode,
+                                 requested_board)
+from .lobby import Lobby
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class FrontEnd():
+    """Front end of a sharded server.
+
+    Clients connect to the ROUTER socket at endpoint, exactly as they do
+    with a single Server. Every match lives in one of the worker processes,
+    chosen by a stable hash of the match id. The front end pairs logins
+    into matches itself: a LOGIN request waits in the lobby until a
+    partner arrives, and then both are forwarded to the worker, with
+    OPTION_MATCH added to tell it which match to join. After that, requests are
+    routed by the match id in the header of binary messages, or by the
+    match id remembered for the client.
+
+    Workers connect to the back end with a DEALER socket, and can be
+    restarted at any time: a new worker takes over the identity of the one
+    it replaces. The matches of a worker that died are lost, though.
+
+    If spectate is given, the spectator messages the workers publish to
+    PUBLISH_BACKEND are forwarded to the subscribers at spectate, and
+    their subscriptions to the workers.
+
+    Logins that wait longer than lobby_timeout seconds for a partner are
+    refused. The match id of a client is forgotten when the client sent
+    nothing for route_timeout seconds, which is longer than a worker
+    lets a match wait, so that clients that never log out do not pile
+    up. Either timeout can be None.
+    """
+    def __init__(self, workers, endpoint, backend=BACKEND, worker_options=None, spectate=None,
+                 lobby_timeout=LOBBY_TIMEOUT, route_timeout=2*TURN_TIMEOUT):
+        self.n_workers = workers
+        self.backend_endpoint = backend
+        self.worker_options = worker_options or {}
+        self.context = zmq.Context.instance()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.frontend.bind(endpoint)
+        self.backend = self.context.socket(zmq.ROUTER)
+        self.backend.setsockopt(zmq.ROUTER_HANDOVER, 1)
+        self.backend.bind(backend)
+        self.publisher = self.subscriber = None
+        if spectate:
+            self.publisher = self.context.socket(zmq.XPUB)
+            self.publisher.setsockopt(zmq.XPUB_VERBOSE, 1)
+            self.publisher.setsockopt(zmq.SNDHWM, 100)
+            self.publisher.bind(spectate)
+            self.subscriber = self.context.socket(zmq.XSUB)
+            self.subscriber.bind(PUBLISH_BACKEND)
+        self.routes = OrderedDict() # client identity -> match id, least recently used first
+        self.t_route = {} # client identity -> time of its last request
+        self.lobby_timeout = lobby_timeout
+        self.route_timeout = route_timeout
+        self.lobby = Lobby()
+        self.next_match_id = 0
+        self.processes = {} # worker -> Process
+        logger.info(f"Zeeslag front end started for {workers} workers...")
+
+    def shard(self, match_id):
+        return zlib.crc32(b"%d" % (match_id)) % self.n_workers
+
+    def pair(self, client, request):
+        """Pairs a LOGIN request into a match.
+
+        Returns a list of (client, request, match id) to forward: empty if
+        the client waits in the lobby. Raises ValueError if the client asked
+        for a size or fleet that makes no game.
+        """
+        options = protocol.decode_string(request[2:])
+        match_id = requested_match(options)
+        if match_id is not None:
+            self.lobby.leave(client)
+            self.route(client, match_id)
+            return [(client, request, match_id)]
+        game = (requested_mode(options), *requested_board(options))
+        partner = self.lobby.join(client, game, request)
+        if partner is None:
+            return []
+        match_id = self.next_match_id
+        self.next_match_id += 1
+        paired = []
+        # the partner waited longest, and becomes player 0.
+        for c, r in (partner, (client, request)):
+            r.append(f"{OPTION_MATCH}{match_id}".encode())
+            self.route(c, match_id)
+            paired.append((c, r, match_id))
+        return paired
+
+    def route(self, client, match_id):
+        self.routes[client] = match_id
+        self.routes.move_to_end(client)
+        self.t_route[client] = time.monotonic()
+
+    def expire(self):
+        """Refuses the logins that waited too long, and forgets the routes of silent clients."""
+        if self.lobby_timeout:
+            for client, request in self.lobby.expire(self.lobby_timeout):
+                self.frontend.send_multipart([client, b"", *protocol.encode_string([LOGIN, LOGIN_ERROR, ""])])
+        if self.route_timeout:
+            t = time.monotonic() - self.route_timeout
+            while self.routes:
+                client = next(iter(self.routes))
+                if self.t_route[client] > t:
+                    break
+                del self.routes[client]
+                del self.t_route[client]
+
+    def forward(self, client, request):
+        if request[:1] == [LOGIN.encode()]:
+            try:
+                paired = self.pair(client, request)
+            except ValueError as e:
+                logger.warning(f"Refused a login: {e}")
+                self.frontend.send_multipart([client, b"", *protocol.encode_string([LOGIN, LOGIN_ERROR, ""])])
+                return
+            for c, r, match_id in paired:
+                worker = worker_identity(self.shard(match_id))
+                self.backend.send_multipart([worker, c, b"", *r])
+            return
+        try:
+            opcode = protocol.opcode(request)
+            match_id = protocol.match_id(request)
+        except ValueError as e:
+            logger.warning(f"Malformed request: {e}")
+            self.frontend.send_multipart([client, b"", *protocol.encode_string([ERROR])])
+            return
+        if match_id is None:
+            match_id = self.routes.get(client)
+        if client in self.routes:
+            self.route(client, self.routes[client])
+        if match_id is None:
+            reply = protocol.encode_string([opcode, ERROR])
+            self.frontend.send_multipart([client, b"", *reply])
+            return
+        if opcode == LOGOUT:
+            self.routes.pop(client, None)
+            self.t_route.pop(client, None)
+        worker = worker_identity(self.shard(match_id))
+        self.backend.send_multipart([worker, client, b"", *request])
+
+    def start_worker(self, worker):
+        ctx = multiprocessing.get_context("spawn")
+        p = ctx.Process(target=run_worker, args=(worker, self.backend_endpoint),
+                        kwargs=self.worker_options, daemon=True)
+        p.start()
+        self.processes[worker] = p
+
+    def check_workers(self):
+        for worker, p in self.processes.items():
+            if not p.is_alive():
+                logger.warning(f"Worker {worker} died (exit code {p.exitcode}), restarting it.")
+                self.start_worker(worker)
+
+    def run(self, spawn_workers=True):
+        # make sure the workers are stopped when we are terminated.
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if spawn_workers:
+            for worker in range(self.n_workers):
+                self.start_worker(worker)
+        poller = zmq.Poller()
+        poller.register(self.frontend, zmq.POLLIN)
+        poller.register(self.backend, zmq.POLLIN)
+        if self.publisher:
+            poller.register(self.publisher, zmq.POLLIN)
+            poller.register(self.subscriber, zmq.POLLIN)
+        t_check = t_status = t_expire = time.monotonic()
+        paired = 0
+        try:
+            while True:
+                sockets = dict(poller.poll(1000))
+                if self.frontend in sockets:
+                    client, *request = self.frontend.recv_multipart()
+                    self.forward(client, request[1:])
+                if self.backend in sockets:
+                    worker, *reply = self.backend.recv_multipart()
+                    self.frontend.send_multipart(reply)
+                if self.subscriber in sockets:
+                    self.publisher.send_multipart(self.subscriber.recv_multipart())
+                if self.publisher in sockets:
+                    self.subscriber.send_multipart(self.publisher.recv_multipart())
+                if spawn_workers and time.monotonic() - t_check > 1:
+                    self.check_workers()
+                    t_check = time.monotonic()
+                if time.monotonic() - t_expire > 1:
+                    self.expire()
+                    t_expire = time.monotonic()
+                if time.monotonic() - t_status > 10:
+                    if self.lobby.depth() or self.lobby.paired != paired:
+                        logger.info(self.lobby.status())
+                        paired = self.lobby.paired
+                    t_status = time.monotonic()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for p in self.processes.values():
+                p.terminate()
+            for socket in (self.frontend, self.backend, self.publisher, self.subscriber):
+                if socket is not None:
+                    socket.close()
@@ -0,0 +1,228 @@
+import multiprocessing
+from functools import lru_cache
+
+import numpy as np
+
+from .battleships import Field
+from .placement import placement_masks, TABLE_LIMIT
+
+import logging
+logger = logging.getLogger(__name__)
+
+# most and least candidate fleets drawn per batch, per process.
+BATCH = 4096
+MIN_BATCH = 256
+
+
+@lru_cache(maxsize=None)
+def cell_placements(length, size=Field.SIZE):
+    """Array (size*size, K) with the placements (rows of placement_masks) covering every cell.
+
+    Rows are padded with -1; K is the most placements any cell has.
+    """
+    masks = placement_masks(length, size)
+    lists = [np.flatnonzero(masks[:, c]) for c in range(size*size)]
+    table = np.full((size*size, max(len(l) for l in lists)), -1)
+    for c, l in enumerate(lists):
+        table[c, :len(l)] = l
+    table.flags.writeable = False
+    return table
+
+
+def draw_fleets(args):
+    """Draws n candidate fleets and keeps those that fit the shots.
+
+    The ships are placed one after the other, off the missed cells. While
+    some hits are not covered by the ships placed before it, a ship is
+    placed with chance targeted on one of those hits (a random one, in a
+    random placement over it), and otherwise anywhere. A fleet is kept if
+    its ships do not overlap and cover every hit. The weight of a fleet
+    is one over the chance it was drawn, which makes the weighted fleets
+    a sample of all fleets that fit, each equally likely. Runs in worker
+    processes as well.
+
+    Returns the cells of the fleets that were kept, as a boolean array
+    (fleets, size*size), and their weights.
+    """
+    size, ships, missed, hits, n, seed, targeted = args
+    rng = np.random.default_rng(seed)
+    occupancy = np.zeros((n, size*size), np.int8)
+    weights = np.ones(n)
+    for length in ships:
+        masks = placement_masks(length, size)
+        allowed = ~(masks & missed).any(axis=1)
+        anywhere = np.flatnonzero(allowed)
+        if not len(anywhere):
+            return np.zeros((0, size*size), bool), np.zeros(0)
+        choice = anywhere[rng.integers(len(anywhere), size=n)]
+        q = np.full(n, (1-targeted)/len(anywhere))
+        uncovered = hits & (occupancy == 0)
+        n_uncovered = uncovered.sum(axis=1)
+        if n_uncovered.any():
+            # placements over every cell that are allowed, and how many there are.
+            table = cell_placements(length, size)
+            over = np.where(table >= 0, allowed[table], False)
+            n_over = over.sum(axis=1)
+            # a random uncovered hit per fleet, and a random allowed placement over it.
+            hit = np.argmax(rng.random(uncovered.shape)*uncovered, axis=1)
+            pick = (rng.random(n)*np.maximum(n_over[hit], 1)).astype(int)
+            k = np.argmax(np.cumsum(over[hit], axis=1) > pick[:, None], axis=1)
+            on_hit = table[hit, k]
+            aim = (rng.random(n) < targeted) & (n_uncovered > 0) & (n_over[hit] > 0)
+            choice = np.where(aim, on_hit, choice)
+            # chance of the choice through any uncovered hit it covers.
+            through = (masks[choice] & uncovered) @ (1/np.maximum(n_over, 1))
+            q += targeted*through/np.maximum(n_uncovered, 1)
+            q = np.where(n_uncovered > 0, q, 1/len(anywhere))
+        else:
+            q[:] = 1/len(anywhere)
+        weights /= q
+        occupancy += masks[choice]
+    kept = (occupancy <= 1).all(axis=1) & (occupancy[:, hits] > 0).all(axis=1)
+    return occupancy[kept].astype(bool), weights[kept]
+
+
+class Heatmap():
+    """Monte Carlo estimate of the chance that a cell of an enemy field holds a ship.
+
+    The estimate is a pool of samples of fleets that fit the shots seen
+    so far: no ship on a missed cell, every hit on a ship. After a shot,
+    the samples that do not fit it any more are dropped and the pool is
+    topped up to samples fleets, so most of the work of earlier turns is
+    kept. The chance of a cell is the weighted fraction of the pool that
+    has a ship there (see draw_fleets).
+
+    ships are the lengths of the ships the hits belong to: by default
+    the whole fleet, in which case the hits of sunk ships are covered by
+    the sampled fleets too. If workers is given, topping up more than
+    BATCH fleets is spread over a pool of that many processes, which
+    pays off when many samples are asked for (see refine). Fields of more
+    than TABLE_LIMIT cells are not supported.
+    """
+    def __init__(self, size=Field.SIZE, ships=Field.SHIPS, samples=2000, seed=None, workers=None,
+                 targeted=0.5):
+        if size*size > TABLE_LIMIT:
+            raise ValueError(f"Heatmaps need fields of at most {TABLE_LIMIT} cells.")
+        self.size = size
+        self.ships = tuple(sorted(ships, reverse=True))
+        self.samples = samples
+        self.rng = np.random.default_rng(seed)
+        self.workers = workers
+        self.targeted = targeted # chance to draw a ship on a hit, while there are hits
+        self.pool = None # multiprocessing.Pool, once needed
+        self.reset()
+
+    def reset(self):
+        """Forget all shots, e.g. for a new game."""
+        cells = self.size*self.size
+        self.missed = np.zeros(cells, bool)
+        self.hits = np.zeros(cells, bool)
+        self.fleets = np.zeros((0, cells), bool)
+        self.weights = np.zeros(0)
+        self.counts = np.zeros(cells) # weighted number of fleets with a ship on a cell
+        self.drawn = 0 # candidate fleets drawn since the last shot
+        self.acceptance = 1.0 # fraction of the candidates of the last batch that fit
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def observe(self, ix, iy, result):
+        """Takes the result of a shot at ix, iy, as returned by check_attacked_coordinates."""
+        c = ix*self.size + iy
+        if result == 0:
+            self.missed[c] = True
+            self.keep(~self.fleets[:, c])
+        elif result > 0:
+            self.hits[c] = True
+            self.keep(self.fleets[:, c])
+        self.drawn = 0
+
+    def update(self, field):
+        """Observes the marks of field (written by process_result) that are new."""
+        marks = np.fromiter((field.cell(ix, iy) for ix in range(self.size) for iy in range(self.size)),
+                            int, self.size*self.size)
+        for c in np.flatnonzero((marks == -1) & ~self.missed):
+            self.observe(*divmod(int(c), self.size), 0)
+        for c in np.flatnonzero((marks <= -2) & ~self.hits):
+            self.observe(*divmod(int(c), self.size), 1)
+
+    def keep(self, kept):
+        dropped = ~kept
+        if dropped.any():
+            self.counts -= self.weights[dropped] @ self.fleets[dropped]
+            np.maximum(self.counts, 0, out=self.counts)
+            self.fleets = self.fleets[kept]
+            self.weights = self.weights[kept]
+
+    def add(self, fleets, weights):
+        self.fleets = np.concatenate([self.fleets, fleets])
+        self.weights = np.concatenate([self.weights, weights])
+        self.counts += weights @ fleets
+
+    def refill(self, limit=20):
+        """Tops the pool up to samples fleets.
+
+        Gives up after drawing limit times samples candidates since the
+        last shot, when almost no fleet fits the shots (e.g. when ships
+        does not match the hits).
+        """
+        while len(self.fleets) < self.samples and self.drawn < limit*self.samples:
+            missing = self.samples - len(self.fleets)
+            jobs = max(1, min(self.workers or 1, missing // BATCH))
+            # enough candidates for what is missing, at the acceptance of the last batch.
+            n = int(min(BATCH, max(MIN_BATCH, 1.2*missing/self.acceptance)))
+            args = [(self.size, self.ships, self.missed, self.hits, n,
+                     self.rng.integers(2**63), self.targeted) for i in range(jobs)]
+            if jobs > 1:
+                if self.pool is None:
+                    self.pool = multiprocessing.Pool(self.workers)
+                results = self.pool.map(draw_fleets, args)
+            else:
+                results = [draw_fleets(args[0])]
+            for fleets, weights in results:
+                self.add(fleets[:missing], weights[:missing])
+                missing = self.samples - len(self.fleets)
+            self.acceptance = max(sum(len(w) for f, w in results)/(jobs*n), 1/BATCH)
+            self.drawn += jobs*n
+        if len(self.fleets) < self.samples:
+            logger.debug(f"Only {len(self.fleets)} of {self.samples} fleets fit the shots.")
+
+    def refine(self, samples):
+        """Grows the pool to samples fleets, for a more accurate estimate."""
+        self.samples = max(self.samples, samples)
+        self.refill()
+
+    def probabilities(self):
+        """Array (size, size) with the chance of a ship on every cell that was not shot at.
+
+        Cells that were shot at are 0.
+        """
+        self.refill()
+        total = self.weights.sum()
+        p = self.counts/total if total else np.zeros_like(self.counts)
+        p[self.missed | self.hits] = 0
+        return p.reshape(self.size, self.size)
+
+    def best(self, exclude=()):
+        """The cell with the highest chance of a ship that was not shot at, as (ix, iy).
+
+        Cells in exclude, such as the shots of a salvo that is still being
+        chosen, are passed over too.
+        """
+        p = self.probabilities().ravel()
+        untried = ~(self.missed | self.hits)
+        for ix, iy in exclude:
+            untried[ix*self.size + iy] = False
+        p[~untried] = 0
+        if not p.any():
+            # nothing fits the shots: fall back on any untried cell.
+            p = untried.astype(float)
+        return divmod(int(np.argmax(p)), self.size)
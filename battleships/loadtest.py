@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import multiprocessing
+import time
+from collections import defaultdict
+
+from .battleships_data import *
+from .battleships import Field
+from .battleships_server import client_task
+from . import battleships_server
+from .strategies import STRATEGIES
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def percentile(samples, p):
+    """p-th percentile of a sorted list of samples (nearest rank)."""
+    if not samples:
+        return float('nan')
+    i = min(len(samples)-1, max(0, int(round(p/100*len(samples)+0.5))-1))
+    return samples[i]
+
+
+class LatencyStats():
+    """Collects latency samples per message type, as recorded by client_task."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples = defaultdict(list)
+        self.t_start = time.perf_counter()
+
+    def record(self, opcode, seconds):
+        self.samples[opcode].append(seconds)
+
+    def report(self):
+        dt = time.perf_counter() - self.t_start
+        turns = len(self.samples["turn"])
+        games = len(self.samples["game"])
+        lines = [f"  {turns/dt:10.1f} turns/s {games/dt:10.2f} games/s  ({dt:.1f} s)"]
+        lines.append(f"  {'message':24s} {'count':>8s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s}")
+        for opcode in sorted(self.samples):
+            samples = sorted(self.samples[opcode])
+            p50, p95, p99 = [percentile(samples, p)*1e3 for p in (50, 95, 99)]
+            lines.append(f"  {opcode:24s} {len(samples):8d} {p50:9.2f} {p95:9.2f} {p99:9.2f}")
+        return "\n".join(lines)
+
+
+async def ramp(clients, steps, step_duration, strategy, host, port, binary=True, salvo=0,
+               server_boards=False, size=Field.SIZE, ships=Field.SHIPS, endpoint=None):
+    """Ramps up to clients bot clients in steps and prints the stats of every step.
+
+    The clients connect to endpoint if it is given, and to host:port
+    otherwise.
+    """
+    stats = LatencyStats()
+    tasks = []
+    try:
+        for step in range(1, steps+1):
+            # clients are paired into matches, so keep an even number.
+            n = max(2, (clients*step//steps)//2*2)
+            while len(tasks) < n:
+                name = f"loadtest-{len(tasks)}"
+                tasks.append(asyncio.create_task(client_task(name, stats, STRATEGIES[strategy](size=size),
+                                                             games=None, delay=0.1,
+                                                             host=host, port=port,
+                                                             binary=binary, single=salvo>0,
+                                                             salvo=max(1, salvo),
+                                                             server_boards=server_boards,
+                                                             size=size, ships=ships,
+                                                             endpoint=endpoint)))
+            # let the new clients log in before measuring.
+            await asyncio.sleep(min(1, step_duration))
+            stats.reset()
+            await asyncio.sleep(step_duration)
+            print(f"Step {step}/{steps}: {n} concurrent clients ({n//2} matches)")
+            print(stats.report(), flush=True)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def main():
+    description='''
+Battleships load generator
+
+    Ramps up the number of concurrent bot clients playing full games
+    against a Battleships server, and reports the throughput and the
+    latency percentiles per message type for every step.
+'''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('HOSTNAME', nargs='?', default=HOST, help=f'Hostname or IP address of the Battleships server. Defaults to "{HOST}".')
+    parser.add_argument('-p', '--port', type=int, default=PORT)
+    parser.add_argument('--endpoint', default=None, help='Connect to (or with --start-server, bind) this zmq endpoint instead of HOSTNAME and port, e.g. "ipc:///tmp/battleships".')
+    parser.add_argument('-c', '--clients', type=int, default=100, help='Number of concurrent clients to ramp up to.')
+    parser.add_argument('-s', '--steps', type=int, default=5, help='Number of steps of the ramp.')
+    parser.add_argument('-d', '--step-duration', type=float, default=10, help='Duration of a step in seconds.')
+    parser.add_argument('--strategy', choices=list(STRATEGIES), default='random')
+    parser.add_argument('--string-protocol', action='store_true', help='Do not use the binary protocol.')
+    parser.add_argument('--salvo', type=int, default=0, help='Play with one request per side and turn, firing this many shots per turn. 0 plays the classic way.')
+    parser.add_argument('--server-boards', action='store_true', help='Let the server keep the boards and resolve the shots (with --salvo shots per turn).')
+    parser.add_argument('--size', type=int, default=Field.SIZE, help=f'Number of rows and columns of the fields. Defaults to {Field.SIZE}.')
+    parser.add_argument('--ships', default=",".join("%d" % (i) for i in Field.SHIPS), help='Lengths of the ships, separated by commas. Defaults to "%(default)s".')
+    parser.add_argument('--start-server', action='store_true', help='Start a server in a separate process first.')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    fmt = "[%(levelname)6s] %(message)s"
+    logging.basicConfig(level=logging.WARNING, format=fmt)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    server = None
+    if args.start_server:
+        server = multiprocessing.Process(target=battleships_server.serve,
+                                         args=(args.endpoint or "tcp://*:%d" % (args.port),), daemon=True)
+        server.start()
+        time.sleep(0.5)
+    try:
+        asyncio.run(ramp(args.clients, args.steps, args.step_duration, args.strategy,
+                         args.HOSTNAME, args.port, not args.string_protocol, args.salvo,
+                         args.server_boards, args.size, tuple(int(i) for i in args.ships.split(",")),
+                         args.endpoint))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.terminate()
@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict, deque
+
+
+class Lobby():
+    """Matchmaking queue of the players waiting for an opponent.
+
+    Players wait per game (such as a turn mode, or a tuple of turn mode,
+    field size and fleet), in order of arrival. A player arriving while
+    someone is waiting for the same game is paired with the one who
+    waited longest; otherwise it joins the queue. The queues are ordered
+    dicts keyed by client identity, the game of every waiting client is
+    kept, and a queue is dropped as soon as it is empty, so arriving,
+    pairing and leaving are all O(1), however many players and games are
+    waiting.
+
+    The depth of the queues and the wait times of the last window pairs
+    are kept for monitoring.
+    """
+    def __init__(self, window=1000):
+        self.queues = {} # game -> OrderedDict: client -> (time of arrival, item), never empty
+        self.games = {} # client -> game it waits for
+        self.waits = deque(maxlen=window) # seconds waited by the last players that were paired
+        self.paired = 0
+
+    def join(self, client, mode, item):
+        """Adds client to the queue of game mode, with item to hand to its partner.
+
+        Returns (partner, partner's item) if a partner was waiting, or None
+        if client has to wait.
+        """
+        self.leave(client)
+        queue = self.queues.get(mode)
+        if queue:
+            partner, (t, partner_item) = queue.popitem(last=False)
+            del self.games[partner]
+            if not queue:
+                del self.queues[mode]
+            self.waits.append(time.monotonic() - t)
+            self.paired += 1
+            return partner, partner_item
+        self.queues[mode] = OrderedDict([(client, (time.monotonic(), item))])
+        self.games[client] = mode
+        return None
+
+    def leave(self, client):
+        """Removes client from the lobby; returns True if it was waiting."""
+        mode = self.games.pop(client, None)
+        if mode is None:
+            return False
+        queue = self.queues[mode]
+        del queue[client]
+        if not queue:
+            del self.queues[mode]
+        return True
+
+    def expire(self, max_wait):
+        """Removes the players that waited max_wait seconds or more.
+
+        Returns the (client, item) of every player removed.
+        """
+        t = time.monotonic() - max_wait
+        expired = []
+        for mode, queue in list(self.queues.items()):
+            while queue:
+                client, (t_arrival, item) = next(iter(queue.items()))
+                if t_arrival > t:
+                    break
+                queue.popitem(last=False)
+                del self.games[client]
+                expired.append((client, item))
+            if not queue:
+                del self.queues[mode]
+        return expired
+
+    def depth(self):
+        """Number of players waiting."""
+        return len(self.games)
+
+    def depths(self):
+        """Number of players waiting, per game."""
+        return {mode: len(queue) for mode, queue in self.queues.items()}
+
+    def longest_wait(self):
+        """Seconds the longest waiting player has been waiting so far."""
+        now = time.monotonic()
+        return max((now - next(iter(queue.values()))[0] for queue in self.queues.values()), default=0)
+
+    def wait_percentile(self, p):
+        """p-th percentile of the recent wait times, in seconds (nearest rank)."""
+        if not self.waits:
+            return float('nan')
+        waits = sorted(self.waits)
+        return waits[min(len(waits)-1, max(0, int(round(p/100*len(waits)+0.5))-1))]
+
+    def status(self):
+        return (f"lobby: {self.depth()} waiting (longest {self.longest_wait():.1f} s), "
+                f"{self.paired} paired, wait p50 {self.wait_percentile(50)*1e3:.1f} ms "
+                f"p95 {self.wait_percentile(95)*1e3:.1f} ms")
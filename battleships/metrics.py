@@ -0,0 +1,102 @@
+import asyncio
+import bisect
+from collections import defaultdict
+
+from .battleships_data import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+# label of the requests with an opcode the server does not know.
+UNKNOWN_OPCODE = "unknown"
+# upper bounds of the latency buckets, in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def label_value(value):
+    """value escaped for a label of the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram():
+    """Counts of observations per bucket, as a Prometheus histogram."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets)+1) # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, n in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += n
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+class Metrics():
+    """Measures of a server, served in the Prometheus text format.
+
+    Recording is cheap: a counter per request and a histogram bucket per
+    reply. Gauges are functions that are only called when the metrics are
+    scraped, so they cost nothing in between.
+    """
+    def __init__(self):
+        self.requests = defaultdict(int) # opcode -> count
+        self.latency = defaultdict(Histogram) # opcode -> Histogram of request to reply times
+        self.gauges = [] # (name, help, function)
+
+    def request(self, opcode):
+        self.requests[opcode] += 1
+
+    def observe(self, opcode, seconds):
+        self.latency[opcode].observe(seconds)
+
+    def gauge(self, name, help, function):
+        self.gauges.append((name, help, function))
+
+    def render(self):
+        lines = ["# HELP battleships_requests_total Requests received, per opcode.",
+                 "# TYPE battleships_requests_total counter"]
+        for opcode, n in sorted(self.requests.items()):
+            lines.append(f'battleships_requests_total{{opcode="{label_value(opcode)}"}} {n}')
+        lines.append("# HELP battleships_latency_seconds Time from a request to its reply, per opcode.")
+        lines.append("# TYPE battleships_latency_seconds histogram")
+        for opcode, histogram in sorted(self.latency.items()):
+            lines.extend(histogram.lines("battleships_latency_seconds", f'opcode="{label_value(opcode)}"'))
+        for name, help, function in self.gauges:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {function()}")
+        return "\n".join(lines) + "\n"
+
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readuntil(b"\r\n\r\n")
+            path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+            if path in (b"/", b"/metrics"):
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(f"HTTP/1.0 {status}\r\n"
+                         "Content-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port=METRICS_PORT, host="127.0.0.1"):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,215 @@
+from functools import lru_cache
+
+from .battleships import Field
+
+import logging
+logger = logging.getLogger(__name__)
+
+# direction of Field.add -> (row step, column step)
+STEPS = dict(R=(0, 1), L=(0, -1), D=(1, 0), U=(-1, 0))
+
+# fields with more cells than this are placed and checked without tables.
+TABLE_LIMIT = 64*64
+
+
+@lru_cache(maxsize=None)
+def placements(length, size=Field.SIZE):
+    """All legal placements of a ship of length on a size x size field.
+
+    Returns a tuple of (mask, ix, iy, direction): mask has bit ix*size+iy
+    set for every cell of the ship (as in BitField), and ix, iy, direction
+    is the start of the ship in the terms of Field.add (0 based). Every
+    set of cells is listed once, going right or down from its top left.
+    """
+    result = []
+    for ix in range(size):
+        for iy in range(size):
+            if iy + length <= size:
+                mask = sum(1 << (ix*size + iy + i) for i in range(length))
+                result.append((mask, ix, iy, "R"))
+            if length > 1 and ix + length <= size:
+                mask = sum(1 << ((ix + i)*size + iy) for i in range(length))
+                result.append((mask, ix, iy, "D"))
+    return tuple(result)
+
+
+@lru_cache(maxsize=None)
+def placement_lookup(length, size=Field.SIZE):
+    """Dict (ix, iy, direction) -> mask of every legal start of a ship of length."""
+    lookup = {}
+    for mask, ix, iy, direction in placements(length, size):
+        lookup[(ix, iy, direction)] = mask
+        if length == 1:
+            lookup.update({(ix, iy, d): mask for d in STEPS})
+        else:
+            # the same cells, seen from the other end.
+            dx, dy = STEPS[direction]
+            end = (ix + dx*(length-1), iy + dy*(length-1))
+            lookup[(*end, "L" if direction == "R" else "U")] = mask
+    return lookup
+
+
+@lru_cache(maxsize=None)
+def placement_masks(length, size=Field.SIZE):
+    """Boolean array (P, size*size) with all legal placements of a ship of length.
+
+    The rows are in the order of placements(). The array is shared, so it
+    is read only. NumPy is imported here, as only the vectorized users of
+    the tables (BatchSimulator, Heatmap) need it.
+    """
+    import numpy as np
+    masks = np.zeros((len(placements(length, size)), size*size), bool)
+    for n, (mask, ix, iy, direction) in enumerate(placements(length, size)):
+        dx, dy = STEPS[direction]
+        for i in range(length):
+            masks[n, (ix + dx*i)*size + iy + dy*i] = True
+    masks.flags.writeable = False
+    return masks
+
+
+def random_fleet(rng, ships=Field.SHIPS, size=Field.SIZE):
+    """Random fleet, drawn from the tables of placements instead of placed on a field.
+
+    rng is a random.Random. The ships are placed longest first. Every ship
+    is drawn from the table of its placements without replacement; a
+    placement that overlaps the ships placed before it is rejected, and
+    the next one is drawn, so every ship is uniformly distributed over the
+    placements that fit. A ship that runs out of placements makes the
+    ship before it go elsewhere (backtracking, which hardly ever happens
+    with the default fleet). The overlap check is a single AND of masks,
+    and there is no field to undo.
+
+    Returns a list with (mask, ix, iy, direction) per ship, in the order
+    of ships; raises ValueError if the fleet does not fit.
+
+    Fields of more than TABLE_LIMIT cells are left to random_sparse_fleet,
+    and have None for mask.
+    """
+    if size*size > TABLE_LIMIT:
+        return random_sparse_fleet(rng, ships, size)
+    order = sorted(range(len(ships)), key=lambda ship: -ships[ship])
+    fleet = [None]*len(ships)
+
+    def place(k, occupied):
+        if k == len(order):
+            return True
+        ship = order[k]
+        candidates = list(placements(ships[ship], size))
+        while candidates:
+            i = rng.randrange(len(candidates))
+            p = candidates[i]
+            if not p[0] & occupied:
+                fleet[ship] = p
+                if place(k+1, occupied | p[0]):
+                    return True
+            # draw without replacement
+            candidates[i] = candidates[-1]
+            candidates.pop()
+        return False
+
+    if not place(0, 0):
+        raise ValueError("The fleet does not fit on the field.")
+    return fleet
+
+
+def random_sparse_fleet(rng, ships=Field.SHIPS, size=Field.SIZE, tries=1000):
+    """Random fleet on a large field, without tables.
+
+    Every ship gets a random start and direction that keeps it on the
+    field, and is drawn again if it overlaps the ships placed before it.
+    On a large field the ships cover almost nothing, so a ship rarely
+    needs more than one draw, and the work does not depend on the size of
+    the field. Returns a list with (None, ix, iy, direction) per ship, in
+    the order of ships; raises ValueError if a ship did not fit in tries
+    draws.
+    """
+    occupied = set()
+    fleet = [None]*len(ships)
+    for ship in sorted(range(len(ships)), key=lambda ship: -ships[ship]):
+        length = ships[ship]
+        for i in range(tries):
+            # both directions have the same number of placements.
+            direction = "R" if rng.random() < 0.5 else "D"
+            dx, dy = STEPS[direction]
+            ix = rng.randrange(size - dx*(length-1))
+            iy = rng.randrange(size - dy*(length-1))
+            cells = [(ix + dx*j, iy + dy*j) for j in range(length)]
+            if occupied.isdisjoint(cells):
+                break
+        else:
+            raise ValueError("The fleet does not fit on the field.")
+        occupied.update(cells)
+        fleet[ship] = (None, ix, iy, direction)
+    return fleet
+
+
+def place_fleet(field, fleet):
+    """Adds the ships of fleet (as returned by random_fleet) to field."""
+    for ship, (mask, ix, iy, direction) in enumerate(fleet):
+        field.add(ix+1, iy+1, ship, direction)
+
+
+def validate_fleet(layout, ships=Field.SHIPS, size=Field.SIZE):
+    """Checks a whole fleet at once.
+
+    layout has (ix, iy, direction) per ship, in the order of ships, as
+    Field.add takes them (but 0 based). Returns the masks of the ships
+    (None on fields of more than TABLE_LIMIT cells, which are checked
+    cell by cell); raises ValueError if a ship is missing, out of the
+    field or overlaps another ship.
+    """
+    if len(layout) != len(ships):
+        raise ValueError(f"Expected {len(ships)} ships, got {len(layout)}.")
+    if size*size > TABLE_LIMIT:
+        occupied = set()
+        for ship, (ix, iy, direction) in enumerate(layout):
+            dx, dy = STEPS[direction]
+            cells = [(ix + dx*j, iy + dy*j) for j in range(ships[ship])]
+            if not all(0 <= jx < size and 0 <= jy < size for jx, jy in cells):
+                raise ValueError(f"Ship {ship} out of domain.")
+            if not occupied.isdisjoint(cells):
+                raise ValueError(f"Ship {ship} overlaps another ship.")
+            occupied.update(cells)
+        return [None]*len(ships)
+    occupied = 0
+    masks = []
+    for ship, (ix, iy, direction) in enumerate(layout):
+        mask = placement_lookup(ships[ship], size).get((ix, iy, direction))
+        if mask is None:
+            raise ValueError(f"Ship {ship} out of domain.")
+        if mask & occupied:
+            raise ValueError(f"Ship {ship} overlaps another ship.")
+        occupied |= mask
+        masks.append(mask)
+    return masks
+
+
+def layout_from_ends(ends, ships=Field.SHIPS, size=Field.SIZE):
+    """Converts the ((ix, iy), (jx, jy)) ends of every ship into a layout.
+
+    Returns the (ix, iy, direction) of every ship, as validate_fleet takes
+    them; raises ValueError if a ship is not straight or has the wrong
+    length. The layout still needs to be validated.
+    """
+    if len(ends) != len(ships):
+        raise ValueError(f"Expected {len(ships)} ships, got {len(ends)}.")
+    layout = []
+    for ship, ((ix, iy), (jx, jy)) in enumerate(ends):
+        if ix == jx:
+            direction = "R" if jy >= iy else "L"
+        elif iy == jy:
+            direction = "D" if jx >= ix else "U"
+        else:
+            raise ValueError(f"Ship {ship} is not straight.")
+        if max(abs(jx - ix), abs(jy - iy)) + 1 != ships[ship]:
+            raise ValueError(f"Ship {ship} does not have length {ships[ship]}.")
+        layout.append((ix, iy, direction))
+    return layout
+
+
+def fleet_ends(field):
+    """The ((ix, iy), (jx, jy)) ends of every ship on field, before the game."""
+    cells = {}
+    for ix, iy, ship in field.ship_cells():
+        cells.setdefault(ship, []).append((ix, iy))
+    return [(min(cells[ship]), max(cells[ship])) for ship in range(len(field.SHIPS))]
@@ -0,0 +1,234 @@
+"""Encoding of the messages exchanged between clients and server.
+
+Messages are lists of strings, such as [ATTACK, "A", "5"]. Rows are
+labelled A to Z, and AA, AB, ... beyond that (see row_label), so fields
+can have more than 26 rows. There are two wire formats:
+
+string  every element is sent as a UTF-8 encoded frame of a multipart
+        message. This is the original protocol, and is always used for
+        LOGIN.
+
+binary  the whole message is packed in one frame: a fixed header
+        (opcode, status, number of coordinates, number of results, match
+        id), followed by the coordinates as pairs of unsigned shorts and
+        the results as signed bytes, packed with a single struct call
+        (so fields can have up to 65536 rows and columns). Names are not sent; the server knows
+        its clients by their socket identity.
+
+A client offers the binary protocol by adding PROTOCOL_BINARY to its
+LOGIN request. A server that supports it, confirms by adding it to the
+LOGIN reply. Both ends then encode their messages in binary. decode()
+recognises the format of a received message by itself.
+
+Besides the protocol, a client can ask for TURN_SINGLE at login. Shots are
+then exchanged with one request per side and per turn:
+
+[SHOT, x1, y1, ..., r1, ...]  fires one or more shots (a salvo) and
+    reports the results r1, ... of the shots received last, if any. The
+    reply [SHOT, r1, ...] has the results of the shots fired.
+[INCOMING]  the reply [INCOMING, x1, y1, ...] has the shots of the opponent.
+[REPORT, r1, ...]  reports results without firing, for the last turn of
+    a game.
+
+With TURN_SERVER instead, the server keeps both boards. Every client
+first uploads its fleet with
+
+[FLEET, x1, y1, x2, y2, ...]  the two ends of every ship, in the order of
+    the fleet of the match. The reply [FLEET, OK] comes when both fleets are in;
+    an invalid fleet gets [FLEET, ERROR].
+
+after which SHOT and INCOMING work as with TURN_SINGLE, except that the
+server resolves the shots: [SHOT, x1, y1, ...] is answered right away
+with the results, without waiting for the defender, and the reply
+[INCOMING, x1, y1, ..., r1, ...] has the results of the opponent's shots
+as well. Nothing is reported, and a SHOT out of turn gets [SHOT, ERROR].
+
+In every mode, [HEARTBEAT] (answered with [HEARTBEAT, OK]) tells the
+server that a client is still there while it is not playing, e.g. while
+its user thinks. A server ends a match in which a player stayed silent
+for too long, or that made no progress for too long; the requests still
+waiting in it get [opcode, ERROR]. A client that waited too long in the
+lobby gets [LOGIN, LOGIN_ERROR].
+
+A request the server does not take on, because the server or its client
+is too busy, is answered right away with [opcode, BUSY] (in the string
+protocol if the client is not logged in yet). Nothing was done with it:
+the client sends it again after a while (see BUSY_BACKOFF).
+"""
+import struct
+
+from .battleships_data import *
+
+OPCODES = (LOGIN, LOGOUT, ATTACK, ATTACK_REQ_RESULT, DEFEND, DEFEND_REQ_RESULT,
+           SHOT, INCOMING, REPORT, FLEET, HEARTBEAT)
+STATUSES = ("", OK, LOGIN_OK, LOGIN_ERROR, LOGOUT_OK, LOGOUT_ERROR, ERROR, BUSY)
+
+OPCODE_IDS = {opcode: i+1 for i, opcode in enumerate(OPCODES)}
+STATUS_IDS = {status: i for i, status in enumerate(STATUSES)}
+
+HEADER = struct.Struct("!BBBBI") # opcode, status, n_coords, n_results, match id
+
+
+def encode_string(message, match_id=0):
+    return [i.encode() for i in message]
+
+
+def decode_string(frames):
+    return [i.decode() for i in frames]
+
+
+def split_args(args):
+    """Splits the arguments of a message in coordinates and results.
+
+    Coordinates are pairs of row letters (see row_label) and a column
+    number, results are numbers that do not follow row letters. Returns a list of (x, y)
+    tuples and a list of results, all still strings.
+    """
+    coords = []
+    results = []
+    x = None
+    for item in args:
+        if item.isalpha():
+            x = item
+        elif x is not None:
+            coords.append((x, item))
+            x = None
+        else:
+            results.append(item)
+    return coords, results
+
+
+def row_label(ix):
+    """Label of row ix (0 based): A to Z, then AA, AB, ... ZZ, AAA and so on."""
+    if ix < 26:
+        return chr(65+ix)
+    label = ""
+    ix += 1
+    while ix:
+        ix, r = divmod(ix-1, 26)
+        label = chr(65+r) + label
+    return label
+
+
+def row_index(label):
+    """Row index (0 based) of a row label, as made by row_label.
+
+    Labels are not case sensitive. A label of digits is the row index
+    itself, for players on large fields that rather count. Raises
+    ValueError if the label is neither.
+    """
+    if label.isdigit():
+        return int(label)
+    label = label.upper()
+    if len(label) == 1 and "A" <= label <= "Z":
+        return ord(label) - 65
+    ix = 0
+    for c in label:
+        if not "A" <= c <= "Z":
+            raise ValueError(f"Not a row: {label!r}")
+        ix = ix*26 + ord(c) - 64
+    if not ix:
+        raise ValueError(f"Not a row: {label!r}")
+    return ix - 1
+
+
+def _layout(n_coords, n_results):
+    layout = _layouts.get((n_coords, n_results))
+    if layout is None:
+        layout = struct.Struct(HEADER.format + "HH"*n_coords + "b"*n_results)
+        _layouts[n_coords, n_results] = layout
+    return layout
+
+_layouts = {}
+
+
+def encode_binary(message, match_id=0):
+    opcode = message[0]
+    status = 0
+    coords = []
+    results = []
+    x = None
+    for item in message[1:]:
+        if not item:
+            continue
+        elif item in STATUS_IDS:
+            status = STATUS_IDS[item]
+        elif opcode == LOGOUT:
+            continue # user name, not sent.
+        elif item.isalpha():
+            x = row_index(item)
+        elif x is not None:
+            coords += (x, int(item))
+            x = None
+        else:
+            results.append(int(item))
+    n_coords = len(coords)//2
+    layout = _layout(n_coords, len(results))
+    return [layout.pack(OPCODE_IDS[opcode], status, n_coords, len(results), match_id,
+                        *coords, *results)]
+
+
+def _header(frame):
+    """The fields of the HEADER of a binary frame; raises ValueError if it is no valid header."""
+    if len(frame) < HEADER.size:
+        raise ValueError(f"Binary message of {len(frame)} bytes is too short.")
+    header = HEADER.unpack_from(frame)
+    opcode, status = header[:2]
+    if not 1 <= opcode <= len(OPCODES):
+        raise ValueError(f"Unknown binary opcode {opcode}.")
+    if status >= len(STATUSES):
+        raise ValueError(f"Unknown binary status {status}.")
+    return header
+
+
+def decode_binary(frame):
+    """Decodes a binary frame; raises ValueError if it is malformed."""
+    opcode, status, n_coords, n_results, match_id = _header(frame)
+    if len(frame) != HEADER.size + 4*n_coords + n_results:
+        raise ValueError(f"Binary message of {len(frame)} bytes does not fit {n_coords} coordinates "
+                         f"and {n_results} results.")
+    message = [OPCODES[opcode-1]]
+    if status:
+        message.append(STATUSES[status])
+    if n_coords or n_results:
+        values = _layout(n_coords, n_results).unpack(frame)[5:]
+        for i in range(n_coords):
+            message += [row_label(values[2*i]), "%d" % (values[2*i+1])]
+        message += ["%d" % (r) for r in values[2*n_coords:]]
+    return message
+
+
+def is_binary(frames):
+    # opcodes of the string protocol are words, binary opcodes are small numbers.
+    return len(frames) == 1 and b"" < frames[0][:1] < b" "
+
+
+def decode(frames):
+    """Decodes a message of either protocol; raises ValueError if it is malformed."""
+    if not frames or not frames[0]:
+        raise ValueError("Message without an opcode.")
+    if is_binary(frames):
+        return decode_binary(frames[0])
+    return decode_string(frames)
+
+
+def opcode(frames):
+    """Opcode of a message, without decoding the rest of it; raises ValueError if there is none."""
+    if not frames or not frames[0]:
+        raise ValueError("Message without an opcode.")
+    if is_binary(frames):
+        return OPCODES[_header(frames[0])[0]-1]
+    return frames[0].decode()
+
+
+def match_id(frames):
+    """Match id carried by a binary message, None for the string protocol.
+
+    Raises ValueError if the binary header is malformed.
+    """
+    if is_binary(frames):
+        return _header(frames[0])[4]
+    return None
+
+
+ENCODERS = {PROTOCOL_STRING: encode_string, PROTOCOL_BINARY: encode_binary}
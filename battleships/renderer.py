@@ -0,0 +1,140 @@
+import itertools
+import shutil
+import sys
+
+from .protocol import row_label
+
+
+def cell_width(size):
+    """Characters per cell, wide enough for the column numbers of a field of size."""
+    return max(3, len("%d" % (size-1)) + 1)
+
+
+def label_width(size):
+    """Characters of the widest row label of a field of size."""
+    return len(row_label(size-1))
+
+
+def viewport_size(size, n_fields=2, lines=None, columns=None):
+    """Rows and columns of a field of size that fit n_fields side by side on the terminal.
+
+    The size of the terminal is asked if lines or columns are not given.
+    Some lines are left for the header and for the messages and prompts
+    under the fields.
+    """
+    terminal = shutil.get_terminal_size()
+    lines = lines or terminal.lines
+    columns = columns or terminal.columns
+    per_field = (columns - 4*(n_fields-1)) // n_fields - label_width(size) - 1
+    return (max(1, min(size, lines - 6)),
+            max(1, min(size, per_field // cell_width(size))))
+
+
+# colour of the digits of a heatmap overlay, per digit (chance of a ship in tenths)
+HEAT_COLORS = ('grey', 'white', 'white', 'yellow', 'yellow', 'yellow', 'red', 'red', 'red', 'red')
+
+
+def heat_symbol(p):
+    """Name of the symbol of a water cell with chance p of a ship: "heat0" .. "heat9"."""
+    return f"heat{min(9, int(p*10))}"
+
+
+def heat_text(symbol, width=3, force_color=True):
+    """Text of a heat symbol: the digit, coloured by how likely a ship is."""
+    from termcolor import colored
+    digit = int(symbol[4:])
+    return colored(" "*(width-2) + "%d" % (digit) + " ", HEAT_COLORS[digit], "on_blue", force_color=force_color)
+
+
+class Renderer():
+    """Draws the enemy and own field side by side on a terminal.
+
+    The whole frame is built in one buffer and written to the terminal in
+    one call. The first frame clears the screen and draws everything at
+    its top. Next frames only redraw the cells whose symbol changed, using
+    cursor addressing, and then clear the screen below the frame, so that
+    messages and prompts appear under the fields.
+
+    Only a viewport of the fields is drawn: by default the whole field,
+    otherwise (ix0, iy0, rows, columns) with the first row and column of
+    the viewport and its size. The work per frame depends on the size of
+    the viewport, not on the size of the fields. Moving the viewport
+    redraws the whole frame.
+
+    If heat is given, an array (size, size) with the chance of a ship per
+    cell, the water cells of the first field show that chance in tenths
+    (see heatmap.Heatmap).
+
+    The layout is the same as the one of Player.draw without a renderer.
+    """
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.previous = None # symbols of the last frame, per field
+        self.viewport = None # viewport of the last frame
+        self.styled = {} # (symbol name, cell width) -> colored cell text
+
+    def invalidate(self):
+        """Redraw the whole frame next time, e.g. after the screen was cleared."""
+        self.previous = None
+
+    def cell_text(self, field, symbol, width=3):
+        text = self.styled.get((symbol, width))
+        if text is None and symbol.startswith("heat"):
+            text = self.styled[symbol, width] = heat_text(symbol, width)
+        elif text is None:
+            from termcolor import colored
+            c = field.SYMBOLS[symbol]
+            fg = field.FGCOLORS[symbol]
+            bg = field.BGCOLORS[symbol]
+            text = (colored(" "*(width-2), fg, "on_blue", force_color=True)
+                    + colored(c, fg, bg, force_color=True)
+                    + colored(" ", fg, bg, force_color=True))
+            self.styled[symbol, width] = text
+        return text
+
+    def frame_origins(self, size, columns=None):
+        # first column (0 based) of the cells of each field
+        left = label_width(size) + 1
+        return (left, left + cell_width(size)*(columns or size) + 4 + left)
+
+    def draw(self, *fields, viewport=None, heat=None):
+        size = fields[0].SIZE
+        ix0, iy0, rows, columns = viewport or (0, 0, size, size)
+        rows = range(ix0, min(size, ix0 + rows))
+        columns = range(iy0, min(size, iy0 + columns))
+        symbols = [[f.symbol(ix, iy) for ix in rows for iy in columns] for f in fields]
+        if heat is not None:
+            symbols[0] = [heat_symbol(heat[ix, iy]) if symbol == "water" else symbol
+                          for symbol, (ix, iy) in zip(symbols[0], itertools.product(rows, columns))]
+        width = cell_width(size)
+        lw = label_width(size)
+        origins = self.frame_origins(size, len(columns))
+        buf = []
+        if self.previous is None or self.viewport != (rows, columns):
+            # full frame
+            buf.append("\x1b[H\x1b[2J")
+            header = "".join(f"{i:>{width-1}} " for i in columns)
+            buf.append(" "*(lw+1) + header + "    " + " "*(lw+1) + header + "\n")
+            for n, ix in enumerate(rows):
+                for k, f in enumerate(fields):
+                    if k:
+                        buf.append("    ")
+                    buf.append(f"{row_label(ix):>{lw}} ")
+                    for m in range(len(columns)):
+                        buf.append(self.cell_text(f, symbols[k][n*len(columns)+m], width))
+                buf.append("\n")
+        else:
+            for k, f in enumerate(fields):
+                previous = self.previous[k]
+                for n, symbol in enumerate(symbols[k]):
+                    if symbol != previous[n]:
+                        row, column = divmod(n, len(columns))
+                        # terminal rows and columns are 1 based; row 1 is the header.
+                        buf.append(f"\x1b[{row+2};{origins[k]+width*column+1}H")
+                        buf.append(self.cell_text(f, symbol, width))
+        # put the cursor under the frame, and clear what was printed there.
+        buf.append(f"\x1b[{len(rows)+3};1H\x1b[J")
+        self.previous = symbols
+        self.viewport = (rows, columns)
+        self.stream.write("".join(buf))
+        self.stream.flush()
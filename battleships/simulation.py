@@ -0,0 +1,146 @@
+import argparse
+import time
+
+import numpy as np
+
+from .battleships import Field
+from .placement import placement_masks
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class BatchSimulator():
+    """Headless simulation of N games of Battleships at once.
+
+    The defending boards are stored as an (N, SIZE, SIZE) array with the
+    same cell encoding as Field.F (0 is water, ship+1 is a ship, and -1,
+    -2, -3 are the marks written by Field.process_result). Fleet placement,
+    shot resolution and win detection work on all games at once; the
+    result codes are the ones of Field.check_attacked_coordinates.
+    """
+    def __init__(self, n, ships=Field.SHIPS, size=Field.SIZE, seed=None):
+        self.n = n
+        self.ships = np.array(ships)
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.masks = {length: placement_masks(length, size) for length in set(ships)}
+        # float matmul goes through BLAS, integer matmul does not.
+        self.masks_T = {length: masks.T.astype(np.float32) for length, masks in self.masks.items()}
+        self.boards = np.zeros((n, size, size), np.int8)
+        self.hits = np.zeros((n, len(ships)), np.int8)
+        self.remaining = np.zeros(n, np.int16)
+        self.shots = np.zeros(n, np.int16)
+        self.won = np.zeros(n, bool)
+
+    @property
+    def cells(self):
+        return self.boards.reshape(self.n, -1)
+
+    def place_fleets(self, games=None):
+        """Places a random fleet on the boards of all (or the selected) games."""
+        if games is None:
+            games = np.arange(self.n)
+        board = np.zeros((len(games), self.size**2), np.int8)
+        occupied = np.zeros((len(games), self.size**2), np.float32)
+        failed = np.zeros(len(games), bool)
+        for ship, length in enumerate(self.ships):
+            masks = self.masks[length]
+            conflicts = (occupied @ self.masks_T[length]) > 0
+            score = self.rng.random(conflicts.shape, np.float32)
+            score[conflicts] = -1
+            choice = score.argmax(axis=1)
+            failed |= score[np.arange(len(games)), choice] < 0
+            chosen = masks[choice]
+            occupied += chosen
+            board[chosen] = ship+1
+        self.cells[games] = board
+        if failed.any():
+            # Fleet got stuck in a corner; rare, so just try those again.
+            self.place_fleets(games[failed])
+        self.hits[games] = 0
+        self.remaining[games] = self.ships.sum()
+        self.shots[games] = 0
+        self.won[games] = False
+
+    def fire(self, ix, iy):
+        """Fires one shot at every game and returns the result codes.
+
+        ix and iy are integer arrays of length N. Shots at games that are
+        already won are ignored and return -1.
+        """
+        games = np.arange(self.n)
+        cells = self.cells
+        flat = ix*self.size + iy
+        cell = cells[games, flat]
+        active = ~self.won
+        result = np.where(cell<0, -1, 0)
+        is_ship = (cell>0) & active
+        ship = np.where(is_ship, cell-1, 0)
+        self.hits[games, ship] += is_ship
+        self.remaining -= is_ship
+        result[is_ship] = 1
+        sunk = is_ship & (self.hits[games, ship] == self.ships[ship])
+        result[sunk] = 2
+        won = is_ship & (self.remaining == 0)
+        result[won] = 3
+        result[~active] = -1
+        # mark the board like Field.process_result does.
+        marks = np.choose(result+1, [cell, -1, -2, -2, -3]).astype(np.int8)
+        cells[games, flat] = marks
+        self.shots += active
+        self.won |= won
+        return result
+
+    def play_random(self):
+        """Plays all games with random shots and returns the shots needed to win."""
+        self.place_fleets()
+        order = self.rng.random((self.n, self.size**2)).argsort(axis=1)
+        for turn in range(self.size**2):
+            flat = order[:, turn]
+            self.fire(flat // self.size, flat % self.size)
+            if self.won.all():
+                break
+        return self.shots.copy()
+
+
+def distribution(shots, size=Field.SIZE):
+    """Histogram of shots-to-win: element i counts the games won with i shots."""
+    return np.bincount(shots, minlength=size**2+1)
+
+
+def summary(shots):
+    p = np.percentile(shots, [5, 50, 95])
+    return dict(games=len(shots), mean=shots.mean(), std=shots.std(),
+                min=shots.min(), p5=p[0], p50=p[1], p95=p[2], max=shots.max())
+
+
+def main():
+    description='''
+Battleships batch simulator
+
+    Plays many games of Battleships at once with a random shooting
+    strategy and reports the distribution of the number of shots
+    needed to win.
+'''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-n', '--games', type=int, default=100000, help='Number of games per batch.')
+    parser.add_argument('-b', '--batches', type=int, default=1, help='Number of batches.')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--histogram', action='store_true', help='Print the full histogram.')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    shots = []
+    for i in range(args.batches):
+        sim = BatchSimulator(args.games, seed=None if args.seed is None else args.seed + i)
+        shots.append(sim.play_random())
+    shots = np.concatenate(shots)
+    dt = time.perf_counter() - t0
+    s = summary(shots)
+    print(f"{s['games']} games in {dt:.2f} s ({s['games']/dt*60:.0f} games/min)")
+    print("shots to win: mean {mean:.2f}, std {std:.2f}, min {min}, p5 {p5:.0f}, median {p50:.0f}, p95 {p95:.0f}, max {max}".format(**s))
+    if args.histogram:
+        for i, count in enumerate(distribution(shots)):
+            if count:
+                print(f"{i:4d} {count}")
@@ -0,0 +1,74 @@
+from .battleships import Field
+
+import logging
+logger = logging.getLogger(__name__)
+
+# fields with more cells than this are sparse by default.
+DENSE_LIMIT = 64*64
+# class of the other fields: plain lists are the fastest to play on (see benchmark.check_backends).
+DENSE_FIELD = Field
+
+
+class SparseField(Field):
+    """Field backend that only stores the cells that are not water.
+
+    The cells of the ships and the marks written by process_result are
+    kept in a dict, so memory and time grow with the number of ship cells
+    and shots instead of with the area of the field. This suits very large
+    fields, such as 1000x1000, where almost every cell is water that was
+    never shot at.
+
+    The public interface behaves like the one of Field.
+    """
+    def __init__(self, size=None, ships=None):
+        if size is not None:
+            self.SIZE = size
+        if ships is not None:
+            self.SHIPS = tuple(ships)
+        self.cells = {} # (ix, iy) -> value as in Field.F, for every cell that is not water
+        self.ships = []
+        self.hits = [0 for i in self.SHIPS]
+        self.afloat = sum(self.SHIPS) # ship cells not hit yet
+
+    def mark(self, X, Y, value):
+        if value:
+            self.cells[X, Y] = value
+        else:
+            self.cells.pop((X, Y), None)
+
+    def cell(self, X, Y):
+        return self.cells.get((X, Y), 0)
+
+    def ship_cells(self):
+        for (ix, iy), value in self.cells.items():
+            if value > 0:
+                yield ix, iy, value - 1
+
+    def check_attacked_coordinates(self, ix, iy):
+        cell = self.cells.get((ix, iy), 0)
+        if cell < 0:
+            r = -1 # already hit: tell them they missed.
+        elif cell == 0:
+            r = 0 # missed
+        else:
+            ship = cell - 1
+            self.hits[ship] += 1
+            self.afloat -= 1
+            if not self.afloat:
+                r = 3 # all ships hit
+            elif self.hits[ship] == self.SHIPS[ship]:
+                r = 2 # ship sunk
+            else:
+                r = 1 # ship hit
+        return r
+
+
+def make_field(size=Field.SIZE, ships=Field.SHIPS, dense=DENSE_FIELD, dense_limit=DENSE_LIMIT):
+    """A field of size x size cells with ships.
+
+    The field is of class dense (Field, or e.g. BitField) if it has no
+    more than dense_limit cells, and a SparseField otherwise.
+    """
+    if size*size <= dense_limit:
+        return dense(size, ships)
+    return SparseField(size, ships)
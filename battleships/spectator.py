@@ -0,0 +1,240 @@
+import argparse
+import asyncio
+import struct
+import sys
+
+import zmq
+
+from .battleships_data import *
+from .eventlog import EV_SHOT, EV_RESULT
+
+import logging
+logger = logging.getLogger(__name__)
+
+SNAPSHOT = b"snapshot"
+UPDATE = b"update"
+END = b"end"
+
+# event, player, x, y, result
+EVENT = struct.Struct("!BBiib")
+
+
+def topic(match_id):
+    # the separator keeps the subscribers of match 1 from getting match 12.
+    return b"match-%d:" % (match_id)
+
+
+def topic_match_id(t):
+    try:
+        return int(t[6:-1])
+    except ValueError:
+        return None
+
+
+class Broadcaster():
+    """Publishes the shots and results of every match to spectators.
+
+    Messages go out on an XPUB socket, with the topic of the match (see
+    topic()) as their first frame:
+
+        [topic, SNAPSHOT, seq, events, name of player 0, name of player 1, size]
+        [topic, UPDATE, seq, events, name of player 0, name of player 1, size]
+        [topic, END, seq]
+
+    where events is a sequence of packed EVENTs, and size is the number of
+    rows and columns of the fields. The game loop only
+    appends events to the history of the match. Every interval seconds,
+    run() publishes the new events of each match in one UPDATE, so a
+    spectator gets at most one message per match and interval, however
+    fast the match is played. Subscribing to a match makes the next tick
+    publish a SNAPSHOT of its whole history too, once per tick no matter
+    how many spectators joined. The fan-out to the subscribers is done by
+    the I/O thread of zmq, so the number of spectators does not add to
+    the work of the game loop. A spectator that cannot keep up loses
+    messages at the high water mark instead of queueing them; it notices
+    the gap in seq and subscribes again to get a new snapshot. The first
+    UPDATE of a match has seq 1, so a spectator that subscribed before the
+    match started needs no snapshot.
+
+    The socket binds to endpoint, or connects to it if bind is false
+    (the workers of a sharded server connect to the front end, which
+    forwards the messages and the subscriptions).
+    """
+    def __init__(self, context, endpoint, bind=True, interval=0.1, hwm=100):
+        self.interval = interval
+        self.socket = context.socket(zmq.XPUB)
+        # get every subscription, so that every late joiner gets a snapshot.
+        self.socket.setsockopt(zmq.XPUB_VERBOSE, 1)
+        self.socket.setsockopt(zmq.SNDHWM, hwm)
+        if bind:
+            self.socket.bind(endpoint)
+        else:
+            self.socket.connect(endpoint)
+        self.history = {} # match id -> bytearray of events
+        self.names = {} # match id -> [name, name]
+        self.sizes = {} # match id -> size of the fields
+        self.pending = {} # match id -> offset of the first event not published yet
+        self.seq = {} # match id -> number of the last UPDATE
+        self.snapshots = set() # matches with new subscribers
+        self.ended = set()
+
+    def login(self, match_id, player, name, size):
+        self.history.setdefault(match_id, bytearray())
+        self.names.setdefault(match_id, ["", ""])[player] = name
+        self.sizes[match_id] = b"%d" % (size)
+        self.seq.setdefault(match_id, 0)
+
+    def event(self, match_id, event, player, x, y, result=0):
+        history = self.history[match_id]
+        self.pending.setdefault(match_id, len(history))
+        history += EVENT.pack(event, player, x, y, result)
+
+    def end(self, match_id):
+        if match_id in self.history:
+            self.ended.add(match_id)
+
+    def subscribed(self, t):
+        match_id = topic_match_id(t)
+        if match_id in self.history:
+            self.snapshots.add(match_id)
+
+    def publish(self):
+        for match_id, offset in self.pending.items():
+            self.seq[match_id] += 1
+            names = [i.encode() for i in self.names[match_id]]
+            self.socket.send_multipart([topic(match_id), UPDATE, b"%d" % (self.seq[match_id]),
+                                        bytes(self.history[match_id][offset:]), *names,
+                                        self.sizes[match_id]])
+        self.pending.clear()
+        for match_id in self.snapshots:
+            names = [i.encode() for i in self.names[match_id]]
+            self.socket.send_multipart([topic(match_id), SNAPSHOT, b"%d" % (self.seq[match_id]),
+                                        bytes(self.history[match_id]), *names, self.sizes[match_id]])
+        self.snapshots.clear()
+        for match_id in self.ended:
+            self.socket.send_multipart([topic(match_id), END, b"%d" % (self.seq.pop(match_id))])
+            del self.history[match_id]
+            del self.names[match_id]
+            del self.sizes[match_id]
+        self.ended.clear()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        t_publish = loop.time() + self.interval
+        try:
+            while True:
+                timeout = max(0, t_publish - loop.time())
+                if await self.socket.poll(timeout*1000):
+                    message = await self.socket.recv()
+                    # b"\x01" + topic subscribes, b"\x00" + topic unsubscribes.
+                    if message[:1] == b"\x01":
+                        self.subscribed(message[1:])
+                    continue
+                self.publish()
+                t_publish = loop.time() + self.interval
+        finally:
+            self.socket.close()
+
+
+class Spectator():
+    """Follows one match, as published by a Broadcaster."""
+
+    def __init__(self, socket, match_id):
+        from .sparse import make_field
+        self.make_field = make_field
+        self.socket = socket
+        self.match_id = match_id
+        self.topic = topic(match_id)
+        self.seq = None # None until the first snapshot
+        self.names = ["", ""]
+        self.fields = [make_field(), make_field()]
+        self.shots = 0
+        self.last = None # (ix, iy) of the last event with a cell
+        self.finished = False
+        self.socket.setsockopt(zmq.SUBSCRIBE, self.topic)
+
+    def resubscribe(self):
+        """Asks for a new snapshot, after missing updates."""
+        self.seq = None
+        self.socket.setsockopt(zmq.UNSUBSCRIBE, self.topic)
+        self.socket.setsockopt(zmq.SUBSCRIBE, self.topic)
+
+    def apply(self, events):
+        for event, player, x, y, result in EVENT.iter_unpack(events):
+            if event == EV_SHOT:
+                self.shots += 1
+            elif event == EV_RESULT:
+                # player is the defender, reporting the result of a shot at its sea.
+                self.fields[player].process_result(result, x, y)
+                self.last = (x, y)
+
+    def process(self, frames):
+        """Applies a message; returns True if the fields changed."""
+        kind, seq = frames[1], int(frames[2])
+        if kind != END and int(frames[6]) != self.fields[0].SIZE:
+            # the fields of the match are not the default ones.
+            self.fields = [self.make_field(int(frames[6])) for i in range(2)]
+        if kind == SNAPSHOT:
+            if self.seq is not None and seq <= self.seq:
+                return False
+            self.fields = [self.make_field(self.fields[0].SIZE) for i in range(2)]
+            self.shots = 0
+            self.apply(frames[3])
+        elif kind == UPDATE:
+            if self.seq is None and seq == 1:
+                # watching from the start of the match.
+                self.seq = 0
+            if self.seq is None or seq <= self.seq:
+                # waiting for a snapshot, or already in the snapshot.
+                return False
+            if seq != self.seq + 1:
+                logger.info(f"Missed {seq - self.seq - 1} updates, asking for a snapshot.")
+                self.resubscribe()
+                return False
+            self.apply(frames[3])
+        elif kind == END:
+            self.finished = True
+            return False
+        self.names = [i.decode() for i in frames[4:6]]
+        self.seq = seq
+        return True
+
+
+def main():
+    description='''
+Battleships spectator
+
+    Watches a match that is being played on a Battleships server.
+'''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('MATCH', type=int, help='Match id.')
+    parser.add_argument('HOSTNAME', nargs='?', default=HOST, help=f'Hostname or IP address of the Battleships server. Defaults to "{HOST}".')
+    parser.add_argument('-p', '--port', type=int, default=SPECTATE_PORT, help=f'Spectator port of the server. Defaults to {SPECTATE_PORT}.')
+    args = parser.parse_args()
+
+    from .renderer import Renderer, viewport_size
+    context = zmq.Context.instance()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.RCVHWM, 100)
+    socket.connect(f"tcp://{args.HOSTNAME}:{args.port}")
+    spectator = Spectator(socket, args.MATCH)
+    renderer = Renderer() if sys.stdout.isatty() else None
+    try:
+        while not spectator.finished:
+            if not spectator.process(socket.recv_multipart()):
+                continue
+            if renderer:
+                # follow the last shot on fields larger than the terminal.
+                size = spectator.fields[0].SIZE
+                rows, columns = viewport_size(size)
+                ix, iy = spectator.last or (0, 0)
+                viewport = (max(0, min(size - rows, ix - rows//2)),
+                            max(0, min(size - columns, iy - columns//2)), rows, columns)
+                renderer.draw(*spectator.fields, viewport=viewport)
+            names = " vs ".join(f"{i or '?'}" for i in spectator.names)
+            print(f"Match {args.MATCH}: {names}, {spectator.shots} shots.", flush=True)
+        print("The match has ended.")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        socket.close()
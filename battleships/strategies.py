@@ -0,0 +1,226 @@
+import random
+import time
+
+from .battleships import Field
+from .placement import random_fleet, place_fleet
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Strategy():
+    """Base class for automated players.
+
+    A strategy places the fleet on the player's own field and selects the
+    next coordinates to shoot at. It is told the result of every shot it
+    made through notify(), so it can keep its own bookkeeping and never
+    needs to inspect the fields while choosing a move.
+
+    size is the number of rows and columns of the enemy field. On fields
+    of more than SHUFFLE_LIMIT cells, the cells to try are not shuffled
+    up front but drawn at random when needed (untried is None), so the
+    bookkeeping grows with the shots fired instead of with the area.
+
+    The shots of a salvo are all chosen before any of their results is
+    known; the cells chosen but not notified yet are pending, and are not
+    chosen again (see taken and pick).
+    """
+    name = "base"
+    SHUFFLE_LIMIT = 64*64
+
+    def __init__(self, seed=None, size=None):
+        self.rng = random.Random(seed)
+        self.size = size or Field.SIZE
+        self.reset()
+
+    def reset(self):
+        """Forget everything about the current game."""
+        if self.size**2 <= self.SHUFFLE_LIMIT:
+            self.untried = [(ix, iy) for ix in range(self.size) for iy in range(self.size)]
+            self.rng.shuffle(self.untried)
+        else:
+            self.untried = None
+        self.tried = set()
+        self.pending = set()
+
+    def place_ships(self, field):
+        place_fleet(field, random_fleet(self.rng, field.SHIPS, field.SIZE))
+
+    def random_cell(self):
+        return self.rng.randrange(self.size), self.rng.randrange(self.size)
+
+    def next_shot(self):
+        raise NotImplementedError
+
+    def salvo_size(self, n):
+        """Shots to fire in a salvo of n: n, or fewer if fewer cells are left untried."""
+        return min(n, self.size**2 - len(self.tried))
+
+    def taken(self, cell):
+        """Whether cell was shot at, or is in the salvo being chosen."""
+        return cell in self.tried or cell in self.pending
+
+    def pick(self, cell):
+        """Returns cell as the next shot, and keeps it from being chosen again."""
+        self.pending.add(cell)
+        return cell
+
+    def pop_untried(self):
+        while True:
+            cell = self.random_cell() if self.untried is None else self.untried.pop()
+            if not self.taken(cell):
+                return self.pick(cell)
+
+    def notify(self, ix, iy, result):
+        self.tried.add((ix, iy))
+        self.pending.discard((ix, iy))
+
+
+class RandomStrategy(Strategy):
+    """Shoots at random coordinates it has not tried before."""
+    name = "random"
+
+    def next_shot(self):
+        return self.pop_untried()
+
+
+class HuntTargetStrategy(Strategy):
+    """Shoots at random until it hits a ship, then tries the neighbouring cells."""
+    name = "hunt"
+
+    def reset(self):
+        super().reset()
+        self.targets = []
+
+    def hunt(self):
+        return self.pop_untried()
+
+    def next_shot(self):
+        while self.targets:
+            cell = self.targets.pop()
+            if not self.taken(cell):
+                return self.pick(cell)
+        return self.hunt()
+
+    def notify(self, ix, iy, result):
+        super().notify(ix, iy, result)
+        if result == 1:
+            for cell in ((ix-1, iy), (ix+1, iy), (ix, iy-1), (ix, iy+1)):
+                if (0 <= cell[0] < self.size and 0 <= cell[1] < self.size and not self.taken(cell)
+                        and cell not in self.targets):
+                    self.targets.append(cell)
+        elif result == 2:
+            # ship is gone, the cells around it are probably water.
+            self.targets.clear()
+
+
+class ParityStrategy(HuntTargetStrategy):
+    """Hunt/target strategy that only hunts on a checkerboard pattern.
+
+    The smallest ship covers at least two adjacent cells, so every ship
+    is found by shooting at the cells with an even ix+iy only.
+    """
+    name = "parity"
+
+    def reset(self):
+        super().reset()
+        if self.untried is None:
+            return
+        self.odd = [c for c in self.untried if (c[0]+c[1]) % 2]
+        self.untried = [c for c in self.untried if not (c[0]+c[1]) % 2]
+
+    def hunt(self):
+        if self.untried is None:
+            while True:
+                cell = self.random_cell()
+                if not sum(cell) % 2 and not self.taken(cell):
+                    return self.pick(cell)
+        while self.untried:
+            cell = self.untried.pop()
+            if not self.taken(cell):
+                return self.pick(cell)
+        # all even cells tried, but still ships left afloat.
+        self.untried = self.odd
+        self.odd = []
+        return self.pop_untried()
+
+
+class HeatmapStrategy(Strategy):
+    """Shoots at the cell that most likely holds a ship, according to a Heatmap.
+
+    The heatmap is updated with every result instead of being computed
+    again; a move takes tens of milliseconds on a 10x10 field. The
+    enemy fleet is assumed to be the same as the own one (place_ships),
+    Field.SHIPS by default. Fields too large for a Heatmap are played like
+    RandomStrategy. The pending shots of a salvo are passed over by the
+    heatmap too.
+    """
+    name = "heatmap"
+    SAMPLES = 1000
+    ships = Field.SHIPS
+
+    def reset(self):
+        super().reset()
+        from .heatmap import Heatmap
+        from .placement import TABLE_LIMIT
+        if self.size**2 > TABLE_LIMIT:
+            self.heatmap = None
+        else:
+            self.heatmap = Heatmap(self.size, self.ships, self.SAMPLES, seed=self.rng.getrandbits(63))
+
+    def place_ships(self, field):
+        super().place_ships(field)
+        if tuple(field.SHIPS) != self.ships:
+            self.ships = tuple(field.SHIPS)
+            self.reset()
+
+    def next_shot(self):
+        if self.heatmap is None:
+            return self.pop_untried()
+        return self.pick(self.heatmap.best(self.pending))
+
+    def notify(self, ix, iy, result):
+        super().notify(ix, iy, result)
+        if self.heatmap is not None:
+            self.heatmap.observe(ix, iy, result)
+
+
+STRATEGIES = {s.name: s for s in (RandomStrategy, HuntTargetStrategy, ParityStrategy, HeatmapStrategy)}
+
+
+def play_solo(strategy, field=None):
+    """Lets strategy shoot at field until all ships are sunk.
+
+    If field is not given, a Field with a random fleet is used. Returns
+    the number of shots fired and the total time spent choosing moves.
+    """
+    if field is None:
+        field = Field()
+        RandomStrategy().place_ships(field)
+    strategy.reset()
+    shots = 0
+    t_decision = 0
+    while True:
+        t0 = time.perf_counter()
+        ix, iy = strategy.next_shot()
+        t_decision += time.perf_counter() - t0
+        result = field.check_attacked_coordinates(ix, iy)
+        field.process_result(result, ix, iy)
+        t0 = time.perf_counter()
+        strategy.notify(ix, iy, result)
+        t_decision += time.perf_counter() - t0
+        shots += 1
+        if result == 3:
+            return shots, t_decision
+
+
+def measure_decision_cost(strategy_class, games=100, seed=None):
+    """Returns the mean time in microseconds a strategy needs per move."""
+    strategy = strategy_class(seed)
+    n = 0
+    t = 0
+    for i in range(games):
+        shots, dt = play_solo(strategy)
+        n += shots
+        t += dt
+    return t/n*1e6
@@ -0,0 +1,247 @@
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from .battleships import Field
+from .sparse import make_field
+from .strategies import STRATEGIES
+
+import logging
+logger = logging.getLogger(__name__)
+
+# column name -> dtype of the files of a results directory, one value per game.
+COLUMNS = dict(game=np.uint32, a=np.uint8, b=np.uint8, first=np.uint8, winner=np.uint8,
+               shots=np.uint32)
+
+# Elo points per unit of the logistic (natural log) scale.
+ELO = 400/math.log(10)
+
+
+def schedule(n_strategies):
+    """The pairs of a round robin: (a, b) for every a < b."""
+    return list(itertools.combinations(range(n_strategies), 2))
+
+
+def scheduled_game(pairs, games, game):
+    """The players of game number game of a tournament of games games per pair.
+
+    Game k is game k % games of pair k // games of pairs (see schedule),
+    and is started by a if k is even, by b otherwise. Returns (a, b,
+    first), first being 0 for a and 1 for b.
+    """
+    a, b = pairs[game // games]
+    return a, b, game % 2
+
+
+def play_game(strategy_a, strategy_b, first, seed, size=Field.SIZE, ships=Field.SHIPS):
+    """Plays one headless game between two strategies.
+
+    strategy_a and strategy_b are the classes of the players; player
+    first (0 for a, 1 for b) shoots first. Both fleets are placed by the
+    strategies themselves, on fields that follow the rules of Field.
+    Returns the player that won (0 or 1) and the number of shots it
+    fired.
+    """
+    players = [strategy_a(f"{seed}:a", size), strategy_b(f"{seed}:b", size)]
+    fields = [make_field(size, ships) for player in players]
+    for player, field in zip(players, fields):
+        player.place_ships(field)
+    shots = [0, 0]
+    player = first
+    while True:
+        ix, iy = players[player].next_shot()
+        result = fields[1-player].check_attacked_coordinates(ix, iy)
+        fields[1-player].process_result(result, ix, iy)
+        players[player].notify(ix, iy, result)
+        shots[player] += 1
+        if result == 3:
+            return player, shots[player]
+        player = 1 - player
+
+
+def play_chunk(args):
+    """Plays the games in range(start, stop) of a tournament, in a worker process.
+
+    Returns the columns of the results, as arrays.
+    """
+    names, games, start, stop, seed, size, ships = args
+    pairs = schedule(len(names))
+    classes = [STRATEGIES[name] for name in names]
+    columns = {name: np.zeros(stop - start, dtype) for name, dtype in COLUMNS.items()}
+    for n, game in enumerate(range(start, stop)):
+        a, b, first = scheduled_game(pairs, games, game)
+        winner, shots = play_game(classes[a], classes[b], first, f"{seed}:{game}", size, ships)
+        for name, value in zip(COLUMNS, (game, a, b, first, winner, shots)):
+            columns[name][n] = value
+    return columns
+
+
+class Results():
+    """Columnar store of the results of a tournament in directory.
+
+    Every column of COLUMNS is a file of raw values of its dtype, to which
+    the results of every chunk of games are appended as they come in;
+    meta.json has the settings of the tournament. A run that was
+    interrupted is resumed by opening the directory again: a chunk that
+    was written halfway is cut off, and the games that are in every
+    column are not played again.
+    """
+    def __init__(self, directory, meta):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "meta.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = json.load(f)
+            if stored != meta:
+                raise ValueError(f"{directory} has the results of another tournament: {stored}")
+        else:
+            with open(path, "w") as f:
+                json.dump(meta, f)
+        # every column as long as the shortest one.
+        n = min(os.path.getsize(self.path(name)) // np.dtype(dtype).itemsize
+                if os.path.exists(self.path(name)) else 0 for name, dtype in COLUMNS.items())
+        for name, dtype in COLUMNS.items():
+            with open(self.path(name), "ab") as f:
+                f.truncate(n*np.dtype(dtype).itemsize)
+        self.files = {name: open(self.path(name), "ab") for name in COLUMNS}
+
+    def path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def column(self, name):
+        return np.fromfile(self.path(name), COLUMNS[name])
+
+    def played(self):
+        """Set of the games that have been played already."""
+        return set(self.column("game").tolist())
+
+    def append(self, columns):
+        for name, f in self.files.items():
+            columns[name].astype(COLUMNS[name]).tofile(f)
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def elo(a, b, winner, n_strategies, iterations=100):
+    """Elo ratings of the players of a set of games, with their standard errors.
+
+    a, b and winner are the columns of the games (winner 0 means a won).
+    The ratings are the maximum likelihood fit of the Bradley-Terry model,
+    where a player with r more Elo points wins with probability
+    1/(1 + 10**(-r/400)), found by Newton's method and shifted to a mean
+    of 0. The standard errors come from the Fisher information of the
+    fit. Returns two arrays: ratings and standard errors, in Elo points.
+    """
+    # wins[i, j]: games i won from j
+    wins = np.zeros((n_strategies, n_strategies))
+    np.add.at(wins, (np.where(winner == 0, a, b), np.where(winner == 0, b, a)), 1)
+    games = wins + wins.T
+    r = np.zeros(n_strategies)
+    for i in range(iterations):
+        p = 1/(1 + np.exp(r[None, :] - r[:, None])) # p[i, j]: chance that i beats j
+        gradient = (wins - games*p).sum(axis=1)
+        information = games*p*(1 - p)
+        hessian = np.diag(information.sum(axis=1)) - information
+        # the ratings are only known up to a constant: solve with the pseudo inverse.
+        step = np.linalg.pinv(hessian) @ gradient
+        # a player that won or lost everything has no finite rating; keep it finite.
+        r = np.clip(r + step, -20, 20)
+        r -= r.mean()
+        if np.abs(step).max() < 1e-9:
+            break
+    p = 1/(1 + np.exp(r[None, :] - r[:, None]))
+    information = games*p*(1 - p)
+    covariance = np.linalg.pinv(np.diag(information.sum(axis=1)) - information)
+    return r*ELO, np.sqrt(np.maximum(np.diag(covariance), 0))*ELO
+
+
+def report(names, results, z=1.96):
+    a, b, winner = results.column("a"), results.column("b"), results.column("winner")
+    shots = results.column("shots")
+    ratings, errors = elo(a, b, winner, len(names))
+    lines = [f"{len(a)} games",
+             f"  {'strategy':12s} {'games':>8s} {'won':>8s} {'elo':>8s} {'95% ci':>16s} {'shots/win':>10s}"]
+    for i in np.argsort(-ratings):
+        played = (a == i) | (b == i)
+        won = ((a == i) & (winner == 0)) | ((b == i) & (winner == 1))
+        mean_shots = shots[won].mean() if won.any() else float('nan')
+        ci = f"{ratings[i] - z*errors[i]:.0f} .. {ratings[i] + z*errors[i]:.0f}"
+        lines.append(f"  {names[i]:12s} {played.sum():8d} {won.sum():8d} {ratings[i]:8.0f} {ci:>16s} {mean_shots:10.1f}")
+    return "\n".join(lines)
+
+
+def run(directory, names, games, workers=None, seed=0, size=Field.SIZE, ships=Field.SHIPS, chunk=200):
+    """Plays (or resumes) a round robin of games games per pair of strategies names.
+
+    The games are shared in chunks over a pool of workers processes (one
+    per core by default), and the results of every chunk are appended to
+    the Results in directory as soon as it is done. Returns the Results.
+    """
+    meta = dict(strategies=list(names), games=games, seed=seed, size=size, ships=list(ships))
+    results = Results(directory, meta)
+    total = len(schedule(len(names)))*games
+    played = results.played()
+    chunks = [(names, games, start, min(total, start+chunk), seed, size, ships)
+              for start in range(0, total, chunk)
+              if not all(game in played for game in range(start, min(total, start+chunk)))]
+    if played:
+        logger.info(f"Resuming: {len(played)} of {total} games played already.")
+    t0 = time.perf_counter()
+    done = 0
+    try:
+        with multiprocessing.Pool(workers) as pool:
+            for columns in pool.imap_unordered(play_chunk, chunks):
+                # a chunk that was cut off halfway is played again; keep the new games only.
+                new = ~np.isin(columns["game"], list(played)) if played else slice(None)
+                columns = {name: column[new] for name, column in columns.items()}
+                results.append(columns)
+                done += len(columns["game"])
+                dt = time.perf_counter() - t0
+                logger.info(f"{len(played) + done} of {total} games ({done/dt:.0f} games/s)")
+    finally:
+        results.close()
+    return results
+
+
+def main():
+    description='''
+Battleships tournament
+
+    Plays a round robin between computer strategies, headless and using
+    all cores, and rates them with Elo ratings. The results of every game
+    are written to a directory as they come in, so an interrupted
+    tournament is resumed by running the same command again.
+'''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('DIRECTORY', help='Directory for the results.')
+    parser.add_argument('-s', '--strategies', nargs='+', choices=list(STRATEGIES), default=list(STRATEGIES),
+                        help='Strategies to play. Defaults to all of them.')
+    parser.add_argument('-g', '--games', type=int, default=1000, help='Games per pair of strategies.')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='Number of worker processes. Defaults to the number of cores.')
+    parser.add_argument('--chunk', type=int, default=200, help='Games per task of a worker.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--size', type=int, default=Field.SIZE, help=f'Number of rows and columns of the fields. Defaults to {Field.SIZE}.')
+    parser.add_argument('--ships', default=",".join("%d" % (i) for i in Field.SHIPS), help='Lengths of the ships, separated by commas. Defaults to "%(default)s".')
+    args = parser.parse_args()
+
+    fmt = "[%(levelname)6s] %(message)s"
+    logging.basicConfig(level=logging.WARNING, format=fmt)
+    logger.setLevel(logging.INFO)
+    ships = tuple(int(i) for i in args.ships.split(","))
+    try:
+        results = run(args.DIRECTORY, args.strategies, args.games, args.workers, args.seed,
+                      args.size, ships, args.chunk)
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume.")
+        return
+    print(report(args.strategies, results))
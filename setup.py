@@ -45,6 +45,12 @@ setup(
     install_requires=install_requires,
     include_package_data=True,
     entry_points = {'console_scripts':['battleships = battleships.battleships:main',
-                                       'battleships_server = battleships.battleships_server:main'],
+                                       'battleships_server = battleships.battleships_server:main',
+                                       'battleships_simulate = battleships.simulation:main',
+                                       'battleships_loadtest = battleships.loadtest:main',
+                                       'battleships_replay = battleships.eventlog:main',
+                                       'battleships_spectate = battleships.spectator:main',
+                                       'battleships_tournament = battleships.tournament:main',
+                                       'battleships_benchmark = battleships.benchmark:main'],
                     'gui_scripts':[]}
 )